@@ -11,13 +11,20 @@ from pathlib import Path
 import plotly.io as pio
 
 from core.prediction import Prediction
-from core.market_screener import heatmap, heatmap_portfolio, correlations
-from core.portfolio import generate_portfolio
+from core.market_screener import heatmap, correlation_edges
+from core.portfolio import PORTFOLIO_COLUMNS, Portfolio, PortfolioValuation, generate_portfolio
 from GUI.colour_coding import color_coding_rules as crr
-from core.network_graphing import network_graph
+from core.network_graphing import MIN_THRESHOLD, network_graph
 from data.fetch_data import stock_data
 from core.indicators import Indicators
+from core.indicator_pipeline import IndicatorPipeline
 from core.verdict import Verdict
+from core.streaming_indicators import StreamingIndicators, STREAMING_PATH
+
+
+# everything the stock chart and its verdict need, shared intermediates (the emas of the macd, the sma of the bands)
+# are only calculated once
+CHART_INDICATORS = IndicatorPipeline("sma30, sma100, ema12, ema26, macd(12,26,9), bb(30), rsi14, atr14")
 
 
 class GUI:
@@ -68,6 +75,17 @@ class GUI:
         if 'portfolio_df' not in st.session_state:
             st.session_state.portfolio_df = None
 
+        # the portfolio of this session, so refreshing will not erase all data
+        if 'portfolio' not in st.session_state:
+            st.session_state.portfolio = Portfolio()
+
+        if 'portfolio_dataframe' not in st.session_state:
+            st.session_state.portfolio_dataframe = pd.DataFrame(columns=PORTFOLIO_COLUMNS)
+
+        # batched valuation of the holdings, kept until the holdings or the prices change
+        if 'portfolio_valuation' not in st.session_state:
+            st.session_state.portfolio_valuation = PortfolioValuation()
+
         if 'df_correlation' not in st.session_state:
             st.session_state.df_correlation = None
 
@@ -148,19 +166,23 @@ class GUI:
         '''
         try:
             indicators = Indicators(self.data)
+            chart_indicators = CHART_INDICATORS.run(self.data)
 
-            self.data_sma_30 = indicators.sma(30)
-            self.data_sma_100 = indicators.sma(100)
+            self.data_sma_30 = chart_indicators['sma30']
+            self.data_sma_100 = chart_indicators['sma100']
 
-            self.ema_12 = indicators.ema(12)
-            self.ema_26 = indicators.ema(26)
+            self.ema_12 = chart_indicators['ema12']
+            self.ema_26 = chart_indicators['ema26']
 
-            self.macd_line, self.signal_line = indicators.macd()
+            self.macd_line = chart_indicators['macd12_26_9']
+            self.signal_line = chart_indicators['signal12_26_9']
             self.macd_histogram = self.macd_line - self.signal_line
 
-            self.lower_band, self.upper_band = indicators.bollinger_bands()
-            self.rsi_data = indicators.rsi()
-            self.atr_data = indicators.atr()
+            self.lower_band = chart_indicators['lower_band30']
+            self.upper_band = chart_indicators['upper_band30']
+            self.rsi_data = chart_indicators['rsi14']
+            # the risk is the latest (scaled) atr
+            self.atr_data = chart_indicators['atr14'].iloc[-1]
 
             verdict = Verdict(
                 self.data, self.data_sma_100, self.data_sma_30, self.ema_26, self.ema_12, self.rsi_data, self.signal_line, self.macd_line, self.lower_band, self.upper_band, self.atr_data)
@@ -184,11 +206,13 @@ class GUI:
         # also some basic error handling, in case input is weird or something
         try:
             prediction = Prediction(
-                self.data_prediction_now, self.predicted_time_frame)
+                self.data_prediction_now, self.predicted_time_frame, paths=10000 if self.show_prediction_bands else 0)
             self.data_pred_future = prediction.data_pred
+            self.prediction_bands = prediction.bands
         except Exception as e:
             print(f"{e}")
             self.data_pred_future = None
+            self.prediction_bands = None
 
 # ==============================================================================================================|
 #                            Visualization                                                                      |
@@ -354,6 +378,9 @@ class GUI:
             self.stock_prediction = st.text_input('Select Stock ticker (AMZN, MSFT, META)',
                                                   help='Select the stock symbol to fetch data for', value='AMZN', key="Input tab 3")
 
+            self.show_prediction_bands = st.checkbox('Show confidence bands', value=False,
+                                                     help='Simulates 10,000 random price paths around the prediction and shows the range most of them end up in')
+
     def user_portfolio(self):
         '''
         This is also for getting data from the user, however due to the difference of structure, it is a different approach
@@ -382,9 +409,8 @@ class GUI:
                 try:
                     self.stock_amount = float(self.stock_amount)
                     self.buy_in_price = float(self.buy_in_price)
-                    stock_data.fetch_stock_data(self.stock_buy, '30d', '1d')
 
-                    # create datafrane from the input
+                    # create datafrane from the input, fails for tickers without prices
                     st.session_state.portfolio_df = generate_portfolio(
                         self.stock_buy, self.stock_amount, self.buy_in_price)
 
@@ -582,9 +608,14 @@ class GUI:
             today_data = self.data_short_term['Close'].iloc[-1]
             today_data = round(today_data, 2)
 
+            # only the minutes that are new since the last refresh are calculated
+            latest = self.update_streaming_indicators().latest()
+
             with self.tab_short:
 
                 st.write(f"{self.stock} : {today_data}$")
+                st.write(
+                    f"RSI: {latest['rsi']:.2f} | MACD Diff: {latest['macd'] - latest['signal']:.4f} | Risk (ATR): {latest['atr']:.2f}%")
                 fig_short_term, (ax) = plt.subplots(figsize=(16, 8))
 
                 ax.set_xlabel('Date')
@@ -598,6 +629,24 @@ class GUI:
         except Exception as e:
             st.error(f"Oops, something went wrong, try again: {e}")
 
+    def update_streaming_indicators(self):
+        '''
+        The indicators of the 1 minute data are kept in session state (and on disk, so they survive a restart),
+        every refresh only moves them forward by the new minutes instead of recalculating the whole frame
+        '''
+        key = f"streaming_{self.stock_short}"
+        path = STREAMING_PATH / f"{self.stock_short}_1m.json"
+
+        streaming = st.session_state.get(key)
+        if streaming is None:
+            streaming = StreamingIndicators.load(path) or StreamingIndicators()
+
+        streaming.update(self.data_short_term)
+        streaming.save(path)
+        st.session_state[key] = streaming
+
+        return streaming
+
     def tab_heatmap(self):
         '''
         Take all the data we have collected so far and create a heatmap of indicators and verdict within the past 6 months and display them as streamlit dataframe. 
@@ -615,6 +664,7 @@ class GUI:
                 # create a dataframe(pandas) with the heatmap function initialized in the data folder
                 with st.spinner('Generating heatmap... This may take a moment.'):
                     # input none none to not interfere with historical data
+                    # serial on purpose, for the S&P 500 starting a process pool takes longer than the screening (see heatmap)
                     st.session_state.heatmap_data = heatmap(None, None)
 
                 st.write('S&P 500 Daily Change Percentage:')
@@ -637,6 +687,12 @@ class GUI:
                     f'stock_crypto/data_saved/heatmap_parquet/{self.quarter_choice}.parquet').copy()
 
         if st.session_state.heatmap_data is not None:
+            # tickers that could not be fetched or screened, instead of printing them to the console
+            left_out = st.session_state.heatmap_data.attrs.get('fetch_errors', {})
+            if left_out:
+                with st.expander(f"{len(left_out)} tickers are not in the heatmap"):
+                    st.write(pd.DataFrame({'Ticker': list(left_out), 'Reason': list(left_out.values())}))
+
             st.dataframe(st.session_state.heatmap_data.style
                          .map(crr.color_code, subset=['Change'])
                          .map(crr.verdict_color, subset=['Verdict'])
@@ -677,6 +733,14 @@ class GUI:
                 ax.plot(self.data_pred_future.index, self.data_pred_future['Close'],
                         label=f"Stock price prediction for the next {self.predicted_time_frame} days", color="#24FF07", linestyle="--")
 
+                if self.prediction_bands is not None:
+                    # a price can't go below 0, even if some random paths do
+                    bands = self.prediction_bands.clip(lower=0)
+                    ax.fill_between(bands.index, bands['p5'], bands['p95'], color="#24FF07", alpha=0.15,
+                                    label="90% of simulated paths")
+                    ax.fill_between(bands.index, bands['p25'], bands['p75'], color="#24FF07", alpha=0.3,
+                                    label="50% of simulated paths")
+
                 ax.legend()
 
                 target_price = self.data_pred_future['Close'].iloc[-1]
@@ -698,6 +762,10 @@ class GUI:
         Again, we offer download buttons as csv file if desired
         """
 
+        # current values and heatmap of all holdings in one batch, reused as long as neither holdings nor prices change
+        st.session_state.portfolio_df, heatmap_portf = st.session_state.portfolio_valuation.value(
+            st.session_state.portfolio.holdings)
+
         # visualize the dataframe and heatmap of the portfolio
         # use some of the colours initialized in colour coding for the change
         st.dataframe(st.session_state.portfolio_df.style.map(
@@ -708,7 +776,6 @@ class GUI:
         st.download_button(label="Download your portfolio as csv",
                            data=portfolio_csv, file_name="Portfolio.csv", mime="text/csv")
 
-        heatmap_portf = heatmap_portfolio(st.session_state.portfolio_df)
         heatmap_portf_csv = heatmap_portf.to_csv(
             index=False).encode('utf-8')
 
@@ -725,6 +792,32 @@ class GUI:
         st.download_button(label="Download your heatmap as csv", data=heatmap_portf_csv,
                            file_name='Portfolio heatmap.csv', mime="text/csv")
 
+        # value of the current holdings over the last 5 years, only when asked for since it needs the longer history
+        if st.checkbox("Show portfolio value over time"):
+            try:
+                equity_curve = st.session_state.portfolio.equity_curve(period='5y')
+
+                if equity_curve.attrs['missing']:
+                    st.warning(f"No prices for {', '.join(equity_curve.attrs['missing'])}, they are not part of the history")
+
+                fig_portfolio, (ax_value, ax_drawdown) = plt.subplots(
+                    2, 1, figsize=(16, 8), sharex=True, gridspec_kw={'height_ratios': [3, 1]})
+
+                ax_value.plot(equity_curve.index, equity_curve['Value'], label="Portfolio value", color='blue')
+                ax_value.plot(equity_curve.index, equity_curve['Invested'], label="Invested", color='gray', linestyle='--')
+                ax_value.set_ylabel('Value (USD)')
+                ax_value.grid()
+                ax_value.legend()
+
+                ax_drawdown.fill_between(equity_curve.index, equity_curve['Drawdown'] * 100, 0, color='red', alpha=0.4)
+                ax_drawdown.set_ylabel('Drawdown (%)')
+                ax_drawdown.set_xlabel('Date')
+                ax_drawdown.grid()
+
+                st.pyplot(fig_portfolio)
+            except Exception as e:
+                st.error(f"Could not calculate the portfolio history: {e}")
+
         st.info("Note that you can only add one stock of each kind")
 
     def tab_network_graph(self):
@@ -749,7 +842,7 @@ class GUI:
 
             with tab_current_adjustable:
                 # user input for the threshold, for better analysis and interactivity
-                threshold = st.slider("Threshold for the correlations", min_value=0.3, max_value=1.0, value=0.7,
+                threshold = st.slider("Threshold for the correlations", min_value=MIN_THRESHOLD, max_value=1.0, value=0.7,
                                       help="Bigger correlations usually mean companies are very connected. NOTE: Be aware that a low threshold might slow your PC!")
 
                 # give user the choice between new data or pre calculated data
@@ -757,9 +850,9 @@ class GUI:
 
                     with st.spinner("This will take a while...Please wait"):
 
-                        # create the correlations for the network, explanation is in correlations
-                        st.session_state.df_correlation = correlations(
-                            None, None)
+                        # create the correlations for the network, only the pairs above the threshold (explanation is in correlation_edges)
+                        st.session_state.df_correlation = correlation_edges(
+                            None, None, threshold=threshold)
 
                         fig_network = network_graph(
                             st.session_state.df_correlation, threshold).fig
@@ -767,21 +860,24 @@ class GUI:
                         # plot the network with the calculated correlations and given threshold
 
             with tab_historical_data:
-                # create an option for every entry in the folder and create a select slider, then read parquet and sort
+                # create an option for every quarter in the folders and create a select slider, then read parquet and sort
+                # the edge tables of the conversion job are used instead of the old full matrices where both exist
+                network_quarter_files = {}
                 for file in Path("stock_crypto/data_saved/correlation_parquet").glob("*.parquet"):
+                    network_quarter_files[file.stem.replace('Correlations_', '')] = file
+                for file in Path("stock_crypto/data_saved/edges_parquet").glob("*.parquet"):
+                    network_quarter_files[file.stem.replace('Edges_', '')] = file
 
-                    network_quarter_options.append(f'{file.stem}')
-
-                network_quarter_options.sort()
+                network_quarter_options = sorted(network_quarter_files)
                 network_quarter_choice = st.select_slider(
                     label="Select a quarter to display the network graph from", options=network_quarter_options)
 
-                threshold = st.slider("Threshold for the correlations", min_value=0.3, max_value=1.0, value=0.7,
+                threshold = st.slider("Threshold for the correlations", min_value=MIN_THRESHOLD, max_value=1.0, value=0.7,
                                       help="Bigger correlations usually mean companies are very connected. NOTE: Be aware that a low threshold might slow your PC!", key="Network threshold slider")
 
                 if st.button("Go", key="Network go button"):
                     st.session_state.df_correlation = pd.read_parquet(
-                        f'stock_crypto/data_saved/correlation_parquet/{network_quarter_choice}.parquet').copy()
+                        network_quarter_files[network_quarter_choice]).copy()
 
                     fig_network = network_graph(
                         st.session_state.df_correlation, threshold).fig
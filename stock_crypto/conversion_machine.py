@@ -11,8 +11,10 @@ import plotly as pt
 import sqlite3
 
 
-from core.market_screener import correlations, heatmap
-from core.network_graphing import plot_network
+from core.batch_prediction import BatchPrediction
+from core.market_screener import correlation_edges, heatmap
+from core.network_graphing import MIN_THRESHOLD
+from data.universe import sp500_universe
 
 
 def get_month_end(year, month):
@@ -21,7 +23,12 @@ def get_month_end(year, month):
 
 
 def dataframe_to_parquet_network():
-    '''Converts pandas dataframes into csv and parquet data'''
+    '''
+    Saves the correlation network of every quarter as parquet edge table (ticker_a, ticker_b, corr).
+    Only the pairs above the lowest threshold of the sliders are kept, that's all the networking graph can show
+    '''
+    Path("stock_crypto/data_saved/edges_parquet").mkdir(parents=True, exist_ok=True)
+
     year = 2020
     quarter = 1
     while year < 2026:
@@ -32,15 +39,12 @@ def dataframe_to_parquet_network():
         start_date = date(year, month_start, 1)
         end_date = get_month_end(year, month_start + 2)
 
-        # calculate correlations
-        correlation_dataframe = correlations(start_date, end_date)
+        # calculate the strong correlations, the full matrix is never needed
+        edge_dataframe = correlation_edges(start_date, end_date, threshold=MIN_THRESHOLD)
 
-        correlation_dataframe.fillna(0)
-        correlation_dataframe.clip(-1, 1)
-
-        # save data as parquet(fast for code) and readable csv(if desired)
-        correlation_dataframe.to_parquet(
-            f"stock_crypto/data_saved/correlation_parquet/Correlations_{year}_Q{quarter}.parquet")
+        # save data as parquet(fast for code)
+        edge_dataframe.to_parquet(
+            f"stock_crypto/data_saved/edges_parquet/Edges_{year}_Q{quarter}.parquet")
         print(
             f'Parquet file for {quarter}, {year} has been saved successfully')
         # increase quartal
@@ -78,15 +82,29 @@ def dataframe_to_parquet_heatmap():
             year += 1
 
 
+def predictions_to_parquet():
+    '''Predicts the next 60 days of every S&P 500 ticker and saves them as one parquet file (nightly forecast)'''
+    batch = BatchPrediction(timeframe=60)
+    output = batch.run(sp500_universe.tickers())
+
+    print(f'Predictions have been saved to {output}, {len(batch.errors)} tickers failed')
+    for ticker, error in batch.errors.items():
+        print(f'{ticker}: {error}')
+
+
 # lots of debugging because it is(was) very unstable
 
 
-choice = input(
-    "What do you want to convert?\n -1 correlations \n -2 heatmaps \n -3 parquet \n - DO NOT USE, WORK IN PROGRESS: 4 to sql \n Enter number: ")
+# the menu only runs when the file is started, worker processes of the batch prediction import this module again
+if __name__ == '__main__':
+    choice = input(
+        "What do you want to convert?\n -1 correlations \n -2 heatmaps \n -3 predictions \n - DO NOT USE, WORK IN PROGRESS: 4 to sql \n Enter number: ")
 
-if choice == '1':
-    dataframe_to_parquet_network()
-elif choice == '2':
-    dataframe_to_parquet_heatmap()
-else:
-    print("Invalid input, try again")
+    if choice == '1':
+        dataframe_to_parquet_network()
+    elif choice == '2':
+        dataframe_to_parquet_heatmap()
+    elif choice == '3':
+        predictions_to_parquet()
+    else:
+        print("Invalid input, try again")
@@ -0,0 +1,190 @@
+'''
+Backtesting for the verdict system: takes the verdict (or buyer score) of every ticker on every day, turns it into
+positions with entry and exit rules and simulates how the portfolio would have done, including trading costs.
+Everything is calculated on whole arrays (dates x tickers), there is no loop over the days, so 10 years of the
+S&P 500 take seconds.
+'''
+
+import numpy as np
+import pandas as pd
+
+from core.batch_indicators import forward_fill
+from core.price_panel import PricePanel
+from core.verdict_engine import VerdictEngine
+
+
+class Backtest:
+    '''
+    Simulates trading on per-day signals for many tickers.
+    For example: history = VerdictEngine().history(panel)
+                 backtest = Backtest(panel, history['verdict'])
+                 backtest.metrics  -> {'total_return': ..., 'max_drawdown': ..., 'hit_rate': ..., ...}
+                 backtest.equity   -> value of 1$ over time
+
+    signals: dataframe of dates x tickers with verdict labels (entry when the label is in entry, exit when it is in exit)
+             or buyer scores (entry from entry_score on, exit from exit_score down)
+    lag: days between the signal and the trade, 1 = trade at the next close (a signal is only known after the close)
+    cost_bps: trading costs in basis points of the traded value (turnover)
+    sizing: 'equal' splits the money equally over all open positions, 'score' by buyer score (needs scores as
+            signals), 'fixed' puts fixed_weight into every open position and keeps the rest as cash
+
+    Weights are rebalanced to their target every day, returns of missing prices count as 0
+    '''
+
+    def __init__(self, close, signals, entry=('Buy', 'Strong Buy'), exit=('Sell', 'Strong Sell'), entry_score=10,
+                 exit_score=-10, lag=1, cost_bps=10, sizing='equal', fixed_weight=0.05, periods_per_year=252):
+        if sizing not in ('equal', 'score', 'fixed'):
+            raise ValueError(f"Unknown sizing {sizing}, use equal, score or fixed")
+
+        if isinstance(close, PricePanel):
+            close = close['Close']
+
+        self.close = close
+        self.signals = signals.reindex(index=close.index, columns=close.columns)
+        self.entry = entry
+        self.exit = exit
+        self.entry_score = entry_score
+        self.exit_score = exit_score
+        self.lag = lag
+        self.cost_bps = cost_bps
+        self.sizing = sizing
+        self.fixed_weight = fixed_weight
+        self.periods_per_year = periods_per_year
+
+        self.run()
+
+    @classmethod
+    def from_panel(cls, panel, engine=None, **options):
+        '''Backtest of the verdicts of a PricePanel, the verdict history is calculated on the way'''
+        engine = engine if engine is not None else VerdictEngine()
+
+        return cls(panel, engine.history(panel)['verdict'], **options)
+
+    # ==================================================================================================
+    #                           SIMULATION
+    # ==================================================================================================
+
+    def _shift(self, values, rows):
+        '''Moves values down by rows (filling the top with zeros), so row t holds what was decided at t - rows'''
+        if rows == 0:
+            return values
+
+        return np.vstack([np.zeros((rows,) + values.shape[1:]), values[:-rows]])
+
+    def _target_positions(self):
+        '''1 while a ticker is held, 0 otherwise: an entry signal opens, an exit signal closes, otherwise nothing changes'''
+        signals = self.signals
+
+        if all(pd.api.types.is_numeric_dtype(dtype) for dtype in signals.dtypes):
+            scores = signals.to_numpy(dtype=np.float64)
+            with np.errstate(invalid='ignore'):
+                entries, exits = scores >= self.entry_score, scores <= self.exit_score
+        else:
+            scores = None
+            entries = signals.isin(self.entry).to_numpy()
+            exits = signals.isin(self.exit).to_numpy()
+
+        # 1 on entries, 0 on exits and NaN on the days in between, which take over the last event
+        events = np.where(entries, 1.0, np.where(exits, 0.0, np.nan))
+        positions = np.nan_to_num(forward_fill(events), nan=0.0)
+
+        return positions, scores
+
+    def _weights(self, positions, scores):
+        '''Portfolio weight of every ticker, depending on the sizing'''
+        if self.sizing == 'fixed':
+            return positions * self.fixed_weight
+
+        if self.sizing == 'score':
+            if scores is None:
+                raise ValueError("Sizing by score needs buyer scores as signals, not verdict labels")
+            size = positions * np.clip(np.nan_to_num(scores, nan=0.0), 0, None)
+        else:
+            size = positions
+
+        total = size.sum(axis=1, keepdims=True)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(total > 0, size / total, 0.0)
+
+    def _trades(self, positions, log_returns):
+        '''
+        Every single trade (entry to exit of one ticker) with its return. The return comes from the cumulative log
+        returns at the entry and the exit, so this works for all trades at once
+        '''
+        # pad with "not held" on both sides, so every entry has an exit (open trades are closed on the last day)
+        padded = np.vstack([np.zeros((1, positions.shape[1])), positions, np.zeros((1, positions.shape[1]))])
+        changes = np.diff(padded, axis=0)
+
+        # nonzero on the transposed array goes ticker by ticker and in time order, so entries and exits pair up
+        entry_columns, entry_rows = np.nonzero(changes.T > 0)
+        _, exit_rows = np.nonzero(changes.T < 0)
+        # a change in row k means the position is gone at close k, the last day is the last possible exit
+        exit_rows = np.minimum(exit_rows, len(positions) - 1)
+
+        cumulative = np.vstack([np.zeros((1, positions.shape[1])), np.cumsum(log_returns, axis=0)])[1:]
+        trade_returns = np.exp(cumulative[exit_rows, entry_columns] - cumulative[entry_rows, entry_columns]) - 1
+
+        return pd.DataFrame({
+            'Ticker': np.asarray(self.close.columns)[entry_columns],
+            'Entry': self.close.index[entry_rows],
+            'Exit': self.close.index[exit_rows],
+            'Return': trade_returns
+        })
+
+    def run(self):
+        '''Runs the simulation, the results end up in the attributes of the backtest'''
+        close = self.close.to_numpy(dtype=np.float64)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns = np.vstack([np.full((1, close.shape[1]), np.nan), close[1:] / close[:-1] - 1])
+        returns = np.nan_to_num(returns, nan=0.0, posinf=0.0, neginf=0.0)
+
+        target, scores = self._target_positions()
+        # the trade happens lag days after the signal
+        positions = self._shift(target, self.lag)
+        weights = self._shift(self._weights(target, scores), self.lag)
+
+        # weights set at close t - 1 earn the return from t - 1 to t
+        held = self._shift(weights, 1)
+        gross = (held * returns).sum(axis=1)
+
+        turnover = np.abs(np.diff(np.vstack([np.zeros((1, weights.shape[1])), weights]), axis=0)).sum(axis=1)
+        net = gross - turnover * self.cost_bps / 10000
+
+        index = self.close.index
+        self.positions = pd.DataFrame(positions, index=index, columns=self.close.columns)
+        self.weights = pd.DataFrame(weights, index=index, columns=self.close.columns)
+        self.returns = pd.Series(net, index=index, name='Return')
+        self.turnover = pd.Series(turnover, index=index, name='Turnover')
+        self.equity = (1 + self.returns).cumprod().rename('Equity')
+        self.trades = self._trades(positions, np.log1p(returns))
+        self.metrics = self._metrics()
+
+        return self
+
+    # ==================================================================================================
+    #                           METRICS
+    # ==================================================================================================
+
+    def _metrics(self):
+        returns = self.returns.to_numpy()
+        equity = self.equity.to_numpy()
+        years = len(returns) / self.periods_per_year
+
+        total_return = equity[-1] - 1 if len(equity) else 0.0
+        volatility = returns.std() * np.sqrt(self.periods_per_year) if len(returns) > 1 else np.nan
+        drawdown = equity / np.maximum.accumulate(equity) - 1 if len(equity) else np.zeros(1)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return {
+                'total_return': total_return,
+                'cagr': (1 + total_return) ** (1 / years) - 1 if years > 0 else np.nan,
+                'volatility': volatility,
+                'sharpe': returns.mean() * self.periods_per_year / volatility if volatility else np.nan,
+                'max_drawdown': drawdown.min(),
+                'hit_rate': (self.trades['Return'] > 0).mean() if len(self.trades) else np.nan,
+                'trades': len(self.trades),
+                # traded value per year as multiple of the portfolio
+                'turnover': self.turnover.sum() / years if years > 0 else np.nan
+            }
@@ -0,0 +1,317 @@
+'''
+Batch version of the Indicators class: every indicator is calculated for all tickers at once on 2-D arrays
+(dates x tickers, e.g. from a PricePanel) instead of one dataframe per ticker. The formulas are the same as in
+core/indicators.py, so the results match the per-ticker methods (up to floating point rounding), the S&P 500 just
+takes a handful of array operations instead of thousands of small pandas calls.
+'''
+
+import math
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+
+def rolling_mean(values, window):
+    '''
+    Mean over the last window rows for every column, NaN as long as the window is not full or contains a NaN
+    (same as pandas rolling(window).mean()). Uses cumulative sums, so the work does not grow with the window
+    '''
+    valid = ~np.isnan(values)
+    sums = np.cumsum(np.where(valid, values, 0.0), axis=0)
+    counts = np.cumsum(valid, axis=0)
+
+    # put a row of zeros on top, so row i - window exists for the first full window as well
+    sums = np.vstack([np.zeros((1,) + values.shape[1:]), sums])
+    counts = np.vstack([np.zeros((1,) + values.shape[1:], dtype=counts.dtype), counts])
+
+    result = np.full(values.shape, np.nan)
+    if len(values) >= window:
+        window_sums = sums[window:] - sums[:-window]
+        window_counts = counts[window:] - counts[:-window]
+        result[window - 1:] = np.where(window_counts == window, window_sums / window, np.nan)
+
+    return result
+
+
+def rolling_std(values, window):
+    '''Sample standard deviation (ddof=1) over the last window rows, same as pandas rolling(window).std()'''
+    # center every column first, otherwise the sum of squares loses a lot of precision for large prices
+    valid = ~np.isnan(values)
+    center = np.where(valid, values, 0.0).sum(axis=0) / np.maximum(valid.sum(axis=0), 1)
+    centered = values - center
+
+    mean = rolling_mean(centered, window)
+    mean_of_squares = rolling_mean(centered ** 2, window)
+    variance = (mean_of_squares - mean ** 2) * window / (window - 1)
+
+    return np.sqrt(np.maximum(variance, 0.0))
+
+
+def ema(values, window):
+    '''
+    Exponential moving average, same as pandas ewm(span=window, adjust=False).mean() - it is the same calculation:
+    pandas runs its ewm loop column by column in compiled code, so a whole 2-D array is still a single call.
+    NaN handling follows pandas: nothing before the first price, a missing price keeps the last value
+    '''
+    return pd.DataFrame(values).ewm(span=window, adjust=False).mean().to_numpy()
+
+
+def tail(values, rows):
+    '''Last rows of values, padded with NaN on top if there are fewer (like missing history, so results don't change)'''
+    values = values[-rows:]
+    if len(values) < rows:
+        values = np.vstack([np.full((rows - len(values),) + values.shape[1:], np.nan), values])
+
+    return values
+
+
+def ema_warm_up(window, tolerance=1e-12):
+    '''
+    Rows an EMA needs before its value doesn't depend on where it started anymore (up to tolerance).
+    The weight of the starting value shrinks by (1 - alpha) every row, so after n rows it's (1 - alpha) ** n
+    '''
+    alpha = 2 / (window + 1)
+
+    return math.ceil(math.log(tolerance) / math.log(1 - alpha))
+
+
+def alignment_order(valid):
+    '''Row order that moves the valid values of every column to the bottom (stable, so the prices keep their order)'''
+    # stable sort puts False (missing) in front of True (valid) without changing the order of the prices
+    return np.argsort(valid, axis=0, kind='stable')
+
+
+def right_align(values, valid):
+    '''
+    Moves the valid values of every column to the bottom, keeping their order, NaN fills the top.
+    After that, the last row holds the latest value of every ticker and the row before it the previous one,
+    just like .iloc[-1] and .iloc[-2] on the ticker's own dataframe
+    '''
+    order = alignment_order(valid)
+    aligned = np.take_along_axis(values, order, axis=0)
+
+    return np.where(np.take_along_axis(valid, order, axis=0), aligned, np.nan)
+
+
+def restore_alignment(values, valid):
+    '''Opposite of right_align: puts values calculated on right aligned arrays back on the original rows'''
+    restored = np.full(values.shape, np.nan)
+    np.put_along_axis(restored, alignment_order(valid), values, axis=0)
+
+    return np.where(valid, restored, np.nan)
+
+
+def forward_fill(values):
+    '''Fills every NaN with the last value above it (per column), the rows before the first value stay NaN'''
+    rows = np.arange(len(values))[:, None]
+    last = np.maximum.accumulate(np.where(np.isnan(values), 0, rows), axis=0)
+
+    return np.take_along_axis(values, last, axis=0)
+
+
+# how return_matrix treats missing prices, see there
+MISSING_POLICIES = ('pairwise', 'drop', 'ffill', 'zero')
+
+
+def return_matrix(close, min_periods=1, missing='pairwise'):
+    '''
+    Daily percentage changes of every ticker, close is a 2-D array of prices on a shared calendar (dates x tickers).
+    Returns the changes and two boolean masks, the dates (of close[1:]) and the tickers that were kept: tickers with
+    less than min_periods changes are left out.
+    missing decides what happens with a missing price:
+        'pairwise' -> the changes next to it are NaN (a correlation then uses the days both tickers have)
+        'drop'     -> dates where any kept ticker has no change are removed
+        'ffill'    -> the last price is carried over, so the change is 0 on the missing day and the whole move
+                      is on the next day with a price
+        'zero'     -> missing changes count as 0
+    '''
+    if missing not in MISSING_POLICIES:
+        raise ValueError(f"Unknown missing data policy {missing}, use {', '.join(MISSING_POLICIES)}")
+
+    close = np.asarray(close, dtype=np.float64)
+    if missing == 'ffill':
+        close = forward_fill(close)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = (close[1:] - close[:-1]) / close[:-1] * 100
+
+    columns = (~np.isnan(returns)).sum(axis=0) >= max(min_periods, 1)
+    returns = returns[:, columns]
+    rows = np.ones(len(returns), dtype=bool)
+
+    if missing == 'zero':
+        returns = np.nan_to_num(returns, nan=0.0)
+    elif missing == 'drop':
+        rows = ~np.isnan(returns).any(axis=1)
+        returns = returns[rows]
+
+    return returns, rows, columns
+
+
+class BatchIndicators:
+    '''
+    Indicators for all tickers at once, every method returns a 2-D array (dates x tickers).
+    For example: batch = BatchIndicators.from_panel(panel)
+                 batch.sma(30)[-1] -> latest SMA30 of every ticker
+
+    Method names and defaults are the same as in Indicators
+    '''
+
+    def __init__(self, close, high=None, low=None):
+        self.close = np.asarray(close, dtype=np.float64)
+        self.high = None if high is None else np.asarray(high, dtype=np.float64)
+        self.low = None if low is None else np.asarray(low, dtype=np.float64)
+
+    @classmethod
+    def from_panel(cls, panel, align=True):
+        '''
+        Takes the arrays of a PricePanel. With align=True, every ticker's prices are moved to the bottom
+        (see right_align), so gaps in the shared calendar don't matter and results equal the per-ticker ones
+        '''
+        if not align:
+            return cls(panel.close, panel.high, panel.low)
+
+        valid = ~np.isnan(panel.close)
+
+        return cls(*(right_align(values, valid) for values in (panel.close, panel.high, panel.low)))
+
+    def sma(self, window):
+        """Calculate Simple Moving Average (SMA)"""
+        return rolling_mean(self.close, window)
+
+    def ema(self, window):
+        """Calculate Exponential Moving Average (EMA)"""
+        return ema(self.close, window)
+
+    def bollinger_bands(self, window=30):
+        """Calculate Bollinger Bands, 2 standard deviations around the SMA"""
+        sma = self.sma(window)
+        std = rolling_std(self.close, window)
+
+        return sma - (std * 2), sma + (std * 2)
+
+    def rsi(self, window=14):
+        """Calculate Relative Strength Index (RSI)"""
+        delta = np.vstack([np.full((1,) + self.close.shape[1:], np.nan), np.diff(self.close, axis=0)])
+
+        # like delta.where(delta > 0, 0): the missing first change counts as 0, but there is nothing before the first price
+        missing = np.isnan(self.close)
+        with np.errstate(invalid='ignore'):
+            gain = np.where(missing, np.nan, np.where(delta > 0, delta, 0.0))
+            loss = np.where(missing, np.nan, np.where(delta < 0, -delta, 0.0))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rs = rolling_mean(gain, window) / rolling_mean(loss, window)
+            rsi = 100 - (100 / (1 + rs))
+
+        return rsi
+
+    def macd(self, short_window=12, long_window=26, signal_window=9):
+        """Calculate Moving Average Convergence Divergence (MACD), returns macd line and signal line"""
+        macd_line = self.ema(short_window) - self.ema(long_window)
+        signal_line = ema(macd_line, signal_window)
+
+        return macd_line, signal_line
+
+    def atr_series(self, window=14, expanding=False):
+        """
+        Average true range over time, scaled to 0-100 by the highest value of every ticker.
+        With expanding=True every day is scaled by the highest value up to that day, which is what Indicators.atr
+        gives if it only gets the data up to that day
+        """
+        previous_close = np.vstack([np.full((1,) + self.close.shape[1:], np.nan), self.close[:-1]])
+
+        # fmax skips NaN, like the max() over the three columns in Indicators.atr
+        true_range = np.fmax(self.high - self.low,
+                             np.fmax(np.abs(self.high - previous_close), np.abs(self.low - previous_close)))
+        atr = rolling_mean(true_range, window)
+
+        if expanding:
+            # running maximum, fmax skips the NaN at the start
+            highest = np.fmax.accumulate(atr, axis=0) if len(atr) else atr
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return (atr / highest) * 100
+
+        # fmax.reduce ignores NaN and gives NaN for tickers without any ATR, without warnings
+        highest = np.fmax.reduce(atr, axis=0) if len(atr) else np.full(atr.shape[1:], np.nan)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (atr / highest) * 100
+
+    def atr(self, window=14):
+        """Average true range, latest value for every ticker (like Indicators.atr)"""
+        return self.atr_series(window)[-1]
+
+    def snapshot(self, **windows):
+        """Only the last two values of every indicator for every ticker, see snapshot()"""
+        return snapshot(self.close, self.high, self.low, **windows)
+
+    def price_change(self):
+        """Price change percentage from the first to the last price of every ticker"""
+        first = np.take_along_axis(self.close, np.argmax(~np.isnan(self.close), axis=0)[None], axis=0)[0]
+
+        return np.round((self.close[-1] - first) / first * 100, 2)
+
+
+class IndicatorSnapshot(NamedTuple):
+    '''
+    The last two values of everything the verdict and the screener read, row 0 is the previous and row 1 the latest value.
+    For one ticker every field has shape (2,), for many tickers (2, tickers). atr is only the latest value
+    '''
+    close: np.ndarray
+    sma_short: np.ndarray
+    sma_long: np.ndarray
+    ema_short: np.ndarray
+    ema_long: np.ndarray
+    macd_line: np.ndarray
+    signal_line: np.ndarray
+    lower_band: np.ndarray
+    upper_band: np.ndarray
+    rsi: np.ndarray
+    atr: np.ndarray
+
+    def ticker(self, column):
+        '''Snapshot of a single ticker out of a snapshot of many'''
+        return IndicatorSnapshot(*(values[..., column] for values in self))
+
+
+def snapshot(close, high, low, sma_windows=(30, 100), ema_windows=(12, 26), macd_windows=(12, 26, 9),
+             bollinger_window=30, rsi_window=14, atr_window=14, tolerance=1e-12):
+    '''
+    Calculates only the last two values of every indicator, out of the shortest tail of the prices that gives them:
+    window + 1 rows for the rolling indicators, a warm-up of ema_warm_up() rows for the EMAs and MACD.
+    close, high and low are 2-D (dates x tickers, every ticker's latest price in the last row, see right_align).
+    The ATR is scaled by its highest value over the whole history (like Indicators.atr), so it still reads all rows
+    '''
+    def rolling_last_two(window, calculate):
+        return calculate(tail(close, window + 1), window)[-2:]
+
+    def ema_last_two(window):
+        return ema(tail(close, ema_warm_up(window, tolerance) + 2), window)[-2:]
+
+    # rsi works on the changes, so one more row is needed
+    rsi_rows = tail(close, rsi_window + 2)
+
+    short_window, long_window, signal_window = macd_windows
+    # the signal line is an ema of the macd line, so it needs the warm-up of both
+    macd_rows = tail(close, ema_warm_up(long_window, tolerance) + ema_warm_up(signal_window, tolerance) + 2)
+    macd_line = ema(macd_rows, short_window) - ema(macd_rows, long_window)
+    signal_line = ema(macd_line, signal_window)
+
+    middle = rolling_last_two(bollinger_window, rolling_mean)
+    std = rolling_last_two(bollinger_window, rolling_std)
+
+    return IndicatorSnapshot(
+        close=tail(close, 2),
+        sma_short=rolling_last_two(sma_windows[0], rolling_mean),
+        sma_long=rolling_last_two(sma_windows[1], rolling_mean),
+        ema_short=ema_last_two(ema_windows[0]),
+        ema_long=ema_last_two(ema_windows[1]),
+        macd_line=macd_line[-2:],
+        signal_line=signal_line[-2:],
+        lower_band=middle - (std * 2),
+        upper_band=middle + (std * 2),
+        rsi=BatchIndicators(rsi_rows).rsi(rsi_window)[-2:],
+        atr=BatchIndicators(close, high, low).atr(atr_window)
+    )
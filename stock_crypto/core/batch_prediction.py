@@ -0,0 +1,163 @@
+'''
+Runs the prediction for many tickers at once (the whole S&P 500 or a portfolio), for example as a nightly job.
+The tickers are split into chunks that run on worker processes, the prices are shared with the workers through
+shared memory. Every finished chunk is written straight into one parquet file (ticker, date, predicted close),
+so the results never have to sit in memory all together. A ticker that fails is recorded in errors and doesn't stop
+the others.
+'''
+
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from core.prediction import Prediction
+from core.price_panel import PricePanel, attach_worker, worker_panel
+from data.fetch_data import stock_data
+
+
+PREDICTION_PATH = Path("stock_crypto/data_saved/predictions")
+
+# columns of the output file
+SCHEMA = pa.schema([('ticker', pa.string()), ('date', pa.timestamp('ns')), ('predicted_close', pa.float64())])
+
+
+def predict_tickers(panel, tickers, timeframe):
+    '''
+    Predictions for some tickers of a panel, returns a dataframe with ticker, date and predicted_close (only the
+    predicted days) and a dictionary ticker -> error message for the tickers that failed
+    '''
+    predictions = []
+    errors = {}
+
+    for ticker in tickers:
+        try:
+            data = panel.frame(ticker)
+            if data.empty:
+                raise ValueError("No prices")
+
+            forecast = Prediction(data, timeframe).data_pred['Close'].iloc[-timeframe:]
+            if forecast.isna().all():
+                raise ValueError("Not enough data for the indicators")
+
+            dates = forecast.index.tz_localize(None) if forecast.index.tz is not None else forecast.index
+            predictions.append(pd.DataFrame({'ticker': ticker, 'date': dates.astype('datetime64[ns]'),
+                                             'predicted_close': forecast.to_numpy(dtype=np.float64)}))
+        except Exception as e:
+            errors[ticker] = str(e)
+
+    if not predictions:
+        return pd.DataFrame({'ticker': pd.Series(dtype=str), 'date': pd.Series(dtype='datetime64[ns]'),
+                             'predicted_close': pd.Series(dtype=np.float64)}), errors
+
+    return pd.concat(predictions, ignore_index=True), errors
+
+
+def _predict_in_worker(tickers, timeframe):
+    return predict_tickers(worker_panel(), tickers, timeframe)
+
+
+class BatchPrediction:
+    '''
+    Predicts many tickers and writes the results to one parquet file.
+    For example: batch = BatchPrediction(timeframe=60)
+                 batch.run(sp500_universe.tickers())   -> path of the parquet file
+                 batch.errors                          -> {ticker: error message} for everything that failed
+
+    tickers can also be a PricePanel, then nothing is downloaded. progress is called with (done, total) tickers after
+    every chunk, by default the progress is printed
+    '''
+
+    def __init__(self, timeframe=60, period='10y', path=PREDICTION_PATH, workers=None, chunk_size=20, progress=None):
+        self.timeframe = timeframe
+        self.period = period
+        self.path = Path(path)
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.progress = progress if progress is not None else self._print_progress
+        self.errors = {}
+
+    def _print_progress(self, done, total):
+        print(f"Predictions: {done}/{total} tickers done, {len(self.errors)} failed")
+
+    def _panel(self, tickers):
+        if isinstance(tickers, PricePanel):
+            return tickers
+
+        return PricePanel.from_download(stock_data.fetch_multiple_stocks_data(list(tickers), self.period, '1d'))
+
+    def run(self, tickers, file_name=None):
+        '''
+        Predicts every ticker and returns the path of the parquet file
+        (data_saved/predictions/Predictions_<today>.parquet unless a file_name is given)
+        '''
+        self.errors = {}
+        requested = tickers.tickers if isinstance(tickers, PricePanel) else list(tickers)
+        panel = self._panel(tickers)
+
+        # tickers the download didn't return at all
+        for ticker in requested:
+            if ticker not in panel:
+                self.errors[ticker] = "No data"
+
+        available = [ticker for ticker in requested if ticker in panel]
+        chunks = [available[i:i + self.chunk_size] for i in range(0, len(available), self.chunk_size)]
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        output = self.path / (file_name or f"Predictions_{date.today().isoformat()}.parquet")
+        # written to a temporary file and swapped in at the end, so an old file is never replaced by half a file
+        temporary = output.with_suffix(f'.{os.getpid()}.tmp')
+
+        with pq.ParquetWriter(temporary, SCHEMA) as writer:
+            if self.workers <= 1 or len(chunks) <= 1:
+                self._run_serial(panel, chunks, writer, len(available))
+            else:
+                self._run_parallel(panel, chunks, writer, len(available))
+
+        os.replace(temporary, output)
+
+        return output
+
+    def _write(self, writer, predictions, errors):
+        self.errors.update(errors)
+
+        if not predictions.empty:
+            writer.write_table(pa.Table.from_pandas(predictions, schema=SCHEMA, preserve_index=False))
+
+    def _run_serial(self, panel, chunks, writer, total):
+        done = 0
+
+        for chunk in chunks:
+            self._write(writer, *predict_tickers(panel, chunk, self.timeframe))
+            done += len(chunk)
+            self.progress(done, total)
+
+    def _run_parallel(self, panel, chunks, writer, total):
+        blocks, description = panel.to_shared()
+        done = 0
+
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=attach_worker,
+                                     initargs=(description,)) as executor:
+                futures = {executor.submit(_predict_in_worker, chunk, self.timeframe): chunk for chunk in chunks}
+
+                for future in as_completed(futures):
+                    chunk = futures[future]
+
+                    try:
+                        self._write(writer, *future.result())
+                    except Exception as e:
+                        # the whole worker failed (e.g. it crashed), only this chunk is lost
+                        self.errors.update({ticker: str(e) for ticker in chunk})
+
+                    done += len(chunk)
+                    self.progress(done, total)
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
@@ -0,0 +1,295 @@
+'''
+Correlation matrix for big universes (Russell 3000, global screens ...), where df.corr() with its dense float64
+matrix on a single thread doesn't work anymore.
+The returns are standardized once, then the matrix is calculated in square tiles with matrix products (BLAS, so
+all cores are used) and written tile by tile into a memory-mapped float32 file. Missing returns are handled pairwise
+like in pandas: every pair only uses the days both tickers have. Tiles are sized so the memory stays within a budget.
+For the network graph only the strong pairs matter, edges() keeps just the pairs above a threshold (or the top k
+neighbours of every ticker) as edge table, so the dense matrix is never there at all.
+'''
+
+import os
+import tempfile
+import weakref
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+CORRELATION_PATH = Path("stock_crypto/data_saved/correlations")
+
+# columns of an edge table, one row per pair (ticker_a before ticker_b in the order of the tickers)
+EDGE_COLUMNS = ['ticker_a', 'ticker_b', 'corr']
+
+
+def _remove_file(path):
+    '''Deletes a temporary matrix file, a file that is still open somewhere (Windows) is left for the next run'''
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def edge_table(tickers, first, second, values):
+    '''
+    Edge table of the pairs (first[i], second[i]) (positions in tickers) with their correlations, sorted by pair.
+    All tickers are kept in attrs['tickers'], so tickers without any edge still show up as nodes
+    '''
+    tickers = np.asarray(tickers, dtype=object)
+    first, second = np.minimum(first, second), np.maximum(first, second)
+    order = np.lexsort((second, first))
+
+    edges = pd.DataFrame({'ticker_a': tickers[first[order]], 'ticker_b': tickers[second[order]],
+                          'corr': np.asarray(values)[order]})
+    edges.attrs['tickers'] = tickers.tolist()
+
+    return edges
+
+
+def edges_from_matrix(correlations, threshold):
+    '''Edge table of all pairs of a correlation dataframe with abs(corr) >= threshold'''
+    matrix = correlations.to_numpy(dtype=np.float64)
+
+    with np.errstate(invalid='ignore'):
+        first, second = np.nonzero(np.triu(np.abs(matrix) >= threshold, 1))
+
+    return edge_table(correlations.index, first, second, matrix[first, second])
+
+
+class CorrelationEngine:
+    '''
+    Pairwise Pearson correlations of many tickers, tile by tile.
+    For example: engine = CorrelationEngine(memory_budget=512 * 2**20)
+                 matrix = engine.compute(returns)          -> N x N float32 memmap
+                 engine.frame(returns_dataframe)           -> the same as dataframe (for universes that fit in memory)
+                 for rows, columns, block in engine.tiles(returns): ...   -> without keeping the matrix at all
+                 engine.edges(returns, tickers, threshold=0.7)       -> only the strong pairs as edge table
+
+    returns: 2-D array (dates x tickers) of daily changes, NaN for missing days (e.g. return_matrix from batch_indicators)
+    memory_budget: bytes the calculation may use; the standardized returns stay in memory, the rest goes to the tiles
+    min_periods: a pair needs at least that many common days, otherwise its correlation is NaN
+    '''
+
+    def __init__(self, memory_budget=512 * 2**20, min_periods=1, tile_size=None):
+        self.memory_budget = memory_budget
+        self.min_periods = min_periods
+        # fixed tile size instead of the one from the memory budget
+        self.tile_size = tile_size
+
+    # ==================================================================================================
+    #                           PREPARATION
+    # ==================================================================================================
+
+    def _standardize(self, returns):
+        '''
+        Returns of every ticker minus its mean, divided by its standard deviation (over all its days), missing days
+        become 0. Correlations don't change through that, but the sums in the tiles stay small and precise
+        '''
+        returns = np.asarray(returns, dtype=np.float64)
+        valid = ~np.isnan(returns)
+        counts = valid.sum(axis=0)
+
+        filled = np.where(valid, returns, 0.0)
+        mean = filled.sum(axis=0) / np.maximum(counts, 1)
+        centered = np.where(valid, returns - mean, 0.0)
+        std = np.sqrt((centered ** 2).sum(axis=0) / np.maximum(counts - 1, 1))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            standardized = np.where(std > 0, centered / std, 0.0)
+
+        # column by column in memory, so the columns of a tile are contiguous for the matrix products
+        return np.asfortranarray(standardized), np.asfortranarray(valid, dtype=np.float64)
+
+    def _tile_size(self, dates, tickers, pairwise):
+        '''Biggest tile that fits into the budget next to the standardized returns'''
+        if self.tile_size is not None:
+            return max(1, min(self.tile_size, tickers))
+
+        # standardized returns (and their squares and the mask for pairwise), around 10 float64 matrices per tile
+        fixed = dates * tickers * 8 * (3 if pairwise else 1)
+        available = self.memory_budget - fixed
+        if available <= 0:
+            print(f"Memory budget of {self.memory_budget} bytes is smaller than the returns ({fixed} bytes), "
+                  f"using small tiles")
+            return max(1, min(64, tickers))
+
+        return max(1, min(int(np.sqrt(available / (10 * 8))), tickers))
+
+    # ==================================================================================================
+    #                           CALCULATION
+    # ==================================================================================================
+
+    def _pairwise_tile(self, standardized, squared, valid, rows, columns):
+        '''Correlations of a tile where every pair uses only the days both tickers have'''
+        x, x2, mx = standardized[:, rows], squared[:, rows], valid[:, rows]
+        y, y2, my = standardized[:, columns], squared[:, columns], valid[:, columns]
+
+        # every sum over the common days of a pair is one matrix product with the masks
+        n = mx.T @ my
+        sum_x, sum_y = x.T @ my, mx.T @ y
+        sum_xx, sum_yy = x2.T @ my, mx.T @ y2
+        sum_xy = x.T @ y
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            covariance = sum_xy - sum_x * sum_y / n
+            variance_x = sum_xx - sum_x ** 2 / n
+            variance_y = sum_yy - sum_y ** 2 / n
+            correlation = covariance / np.sqrt(variance_x * variance_y)
+
+        enough = (n >= max(self.min_periods, 2)) & (variance_x > 0) & (variance_y > 0)
+
+        return np.where(enough, np.clip(correlation, -1, 1), np.nan)
+
+    def _complete_tile(self, standardized, rows, columns, dates):
+        '''Without missing days every correlation is just the product of the standardized returns'''
+        correlation = np.clip(standardized[:, rows].T @ standardized[:, columns] / (dates - 1), -1, 1)
+        # constant tickers have all zeros and no correlation
+        constant_x = ~standardized[:, rows].any(axis=0)
+        constant_y = ~standardized[:, columns].any(axis=0)
+        correlation[constant_x, :] = np.nan
+        correlation[:, constant_y] = np.nan
+
+        if dates < max(self.min_periods, 2):
+            correlation[:] = np.nan
+
+        return correlation
+
+    def tiles(self, returns):
+        '''
+        Generator of (rows, columns, block) for the upper triangle of the matrix (tiles with rows.start <= columns.start),
+        block is the float64 correlation tile matrix[rows, columns]. The lower triangle is the transpose
+        '''
+        returns = np.asarray(returns, dtype=np.float64)
+        dates, tickers = returns.shape
+        pairwise = bool(np.isnan(returns).any())
+
+        standardized, valid = self._standardize(returns)
+        squared = standardized ** 2 if pairwise else None
+        size = self._tile_size(dates, tickers, pairwise)
+
+        for start in range(0, tickers, size):
+            rows = slice(start, min(start + size, tickers))
+
+            for column_start in range(start, tickers, size):
+                columns = slice(column_start, min(column_start + size, tickers))
+
+                if pairwise:
+                    block = self._pairwise_tile(standardized, squared, valid, rows, columns)
+                else:
+                    block = self._complete_tile(standardized, rows, columns, dates)
+
+                if rows == columns:
+                    # a ticker with itself is exactly 1 (if it has a correlation at all)
+                    diagonal = np.diagonal(block).copy()
+                    np.fill_diagonal(block, np.where(np.isnan(diagonal), np.nan, 1.0))
+
+                yield rows, columns, block
+
+    def compute(self, returns, path=None):
+        '''
+        The full N x N correlation matrix as float32 memmap (.npy file, np.load(path, mmap_mode='r') opens it again),
+        written tile by tile. path is the file of the memmap; without a path it's a temporary file in
+        data_saved/correlations that is deleted as soon as the matrix (and every dataframe or view of it) is gone
+        '''
+        tickers = np.shape(returns)[1]
+        temporary = path is None
+
+        if temporary:
+            CORRELATION_PATH.mkdir(parents=True, exist_ok=True)
+            handle, path = tempfile.mkstemp(dir=CORRELATION_PATH, prefix='Correlations_', suffix='.npy')
+            os.close(handle)
+
+        matrix = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(tickers, tickers))
+        if temporary:
+            weakref.finalize(matrix, _remove_file, path)
+
+        for rows, columns, block in self.tiles(returns):
+            matrix[rows, columns] = block
+            matrix[columns, rows] = block.T
+
+        matrix.flush()
+
+        return matrix
+
+    def frame(self, returns, path=None):
+        '''Correlation dataframe of a returns dataframe (dates x tickers), backed by the memmap'''
+        matrix = self.compute(returns.to_numpy(dtype=np.float64), path)
+
+        return pd.DataFrame(matrix, index=returns.columns, columns=returns.columns, copy=False)
+
+    # ==================================================================================================
+    #                           SPARSE EDGES
+    # ==================================================================================================
+
+    def _keep_strongest(self, strongest, rows, block, offset):
+        '''
+        Merges the pairs of a tile into the top k of every row ticker.
+        strongest is (strength, position, correlation), each tickers x top_k, block the tile seen from the row tickers
+        '''
+        strength, position, correlation = strongest
+        top_k = strength.shape[1]
+
+        candidates = np.abs(block)
+        candidates[np.isnan(candidates)] = -np.inf
+
+        merged_strength = np.hstack([strength[rows], candidates])
+        merged_position = np.hstack([position[rows], np.broadcast_to(np.arange(block.shape[1]) + offset, block.shape)])
+        merged_correlation = np.hstack([correlation[rows], block])
+
+        best = np.argpartition(-merged_strength, top_k - 1, axis=1)[:, :top_k]
+        strength[rows] = np.take_along_axis(merged_strength, best, axis=1)
+        position[rows] = np.take_along_axis(merged_position, best, axis=1)
+        correlation[rows] = np.take_along_axis(merged_correlation, best, axis=1)
+
+    def edges(self, returns, tickers, threshold=None, top_k=None):
+        '''
+        Sparse edge table (EDGE_COLUMNS, float32 corr) instead of the matrix: every pair with abs(corr) >= threshold
+        and/or the top_k strongest neighbours of every ticker (a pair is kept once, even if both tickers have the other
+        one in their top k). Only one tile of the matrix exists at a time
+        '''
+        if threshold is None and top_k is None:
+            raise ValueError("Edges need a threshold or top_k")
+
+        tickers = np.asarray(tickers, dtype=object)
+        count = len(tickers)
+        minimum = -np.inf if threshold is None else threshold
+
+        first, second, values = [], [], []
+        if top_k is not None:
+            top_k = min(top_k, max(count - 1, 1))
+            strongest = (np.full((count, top_k), -np.inf), np.full((count, top_k), -1),
+                         np.full((count, top_k), np.nan, dtype=np.float32))
+
+        for rows, columns, block in self.tiles(returns):
+            # the pairs are judged on the float32 values that are saved, so a file filters the same as the calculation
+            block = block.astype(np.float32)
+            with np.errstate(invalid='ignore'):
+                block[~(np.abs(block) >= minimum)] = np.nan
+            if rows == columns:
+                block[np.tril_indices(block.shape[0])] = np.nan
+
+            if top_k is None:
+                row, column = np.nonzero(~np.isnan(block))
+                first.append(row + rows.start)
+                second.append(column + columns.start)
+                values.append(block[row, column])
+            elif rows == columns:
+                # the tile is the upper triangle only, mirrored every ticker sees all its pairs of the tile
+                self._keep_strongest(strongest, rows, np.where(np.isnan(block), block.T, block), rows.start)
+            else:
+                # the column tickers see the same pairs from the other side
+                self._keep_strongest(strongest, rows, block, columns.start)
+                self._keep_strongest(strongest, columns, block.T, rows.start)
+
+        if top_k is not None:
+            strength, position, correlation = strongest
+            row, rank = np.nonzero(strength > -np.inf)
+            pairs = np.column_stack([np.minimum(row, position[row, rank]), np.maximum(row, position[row, rank])])
+            # a pair in the top k of both tickers is kept once
+            _, unique = np.unique(pairs, axis=0, return_index=True)
+            first, second, values = [pairs[unique, 0]], [pairs[unique, 1]], [correlation[row, rank][unique]]
+
+        return edge_table(tickers, np.concatenate(first or [np.zeros(0, dtype=int)]),
+                          np.concatenate(second or [np.zeros(0, dtype=int)]),
+                          np.concatenate(values or [np.zeros(0, dtype=np.float32)]))
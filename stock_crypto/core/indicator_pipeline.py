@@ -0,0 +1,193 @@
+'''
+Declarative indicator pipeline: a consumer writes down which indicators it needs, for example
+"sma30, sma100, ema12, ema26, macd(12,26,9), bb(30), rsi14, atr14", and the pipeline works out how to calculate them.
+The spec is turned into a graph of calculation steps (nodes), every node is calculated once and shared by everything
+that needs it (ema12 is an output on its own and part of the MACD, bb(30) reuses sma30 ...).
+All nodes work on 2-D arrays (dates x tickers) with the batch functions, so one ticker or the whole panel is the same work.
+'''
+
+import re
+
+import numpy as np
+import pandas as pd
+
+from core.batch_indicators import BatchIndicators, ema, restore_alignment, right_align, rolling_mean, rolling_std
+
+
+# default parameters if the spec doesn't give any, same defaults as the Indicators methods
+DEFAULTS = {
+    'rsi': (14,),
+    'atr': (14,),
+    'macd': (12, 26, 9),
+    'bb': (30,)
+}
+
+ALIASES = {
+    'bollinger': 'bb',
+    'bollinger_bands': 'bb'
+}
+
+# name[number] or name(number, number, ...)
+TOKEN = re.compile(r'^([a-z_]+?)\s*(?:(\d+)|\(([\d\s,]*)\))?$')
+
+
+def parse_spec(spec):
+    '''
+    Turns "sma30, macd(12,26,9), rsi" into [('sma', (30,)), ('macd', (12, 26, 9)), ('rsi', (14,))].
+    Raises a ValueError for indicators that don't exist or are missing their window
+    '''
+    indicators = []
+
+    # commas inside brackets belong to the parameters
+    for token in re.split(r',(?![^(]*\))', spec):
+        token = token.strip().lower()
+        if not token:
+            continue
+
+        match = TOKEN.match(token)
+        if match is None:
+            raise ValueError(f"Can't read indicator '{token}'")
+
+        name, number, arguments = match.groups()
+        name = ALIASES.get(name, name)
+
+        if number is not None:
+            parameters = (int(number),)
+        elif arguments:
+            parameters = tuple(int(argument) for argument in arguments.split(','))
+        else:
+            parameters = DEFAULTS.get(name)
+
+        if name not in ('sma', 'ema', 'rsi', 'atr', 'macd', 'bb'):
+            raise ValueError(f"Unknown indicator '{token}'")
+        if parameters is None:
+            raise ValueError(f"'{token}' needs a window, e.g. {name}30")
+        if len(parameters) != len(DEFAULTS.get(name, (0,))):
+            raise ValueError(f"Wrong number of parameters for '{token}'")
+
+        indicators.append((name, parameters))
+
+    return indicators
+
+
+class IndicatorPipeline:
+    '''
+    Calculates the indicators of a spec, every shared intermediate result only once.
+    For example: pipeline = IndicatorPipeline("sma30, sma100, macd(12,26,9), bb(30), rsi14")
+                 result = pipeline.run(data)      -> dataframe with one column per output, same index as data
+                 result['sma30'], result['macd12_26_9'], result['lower_band30'] ...
+                 pipeline.run(panel)              -> dataframe with (output, ticker) columns for a PricePanel
+
+    Output names: sma30, ema12, rsi14, atr14 (scaled to 0-100 like Indicators.atr, over time),
+    macd12_26_9 and signal12_26_9, lower_band30 and upper_band30
+    '''
+
+    def __init__(self, spec):
+        self.spec = spec
+        # node -> (calculate function, nodes it needs), a node is always added after the nodes it needs
+        self.nodes = {}
+        # output name -> node
+        self.outputs = {}
+
+        for name, parameters in parse_spec(spec):
+            self._add_outputs(name, parameters)
+
+    # ==================================================================================================
+    #                           BUILDING THE GRAPH
+    # ==================================================================================================
+
+    def _node(self, key, calculate=None, needs=()):
+        '''Adds a node (if it isn't there yet) after the nodes it needs and returns its key'''
+        if key not in self.nodes:
+            self.nodes[key] = (calculate, tuple(needs))
+
+        return key
+
+    def _price(self, field):
+        return self._node(('price', field))
+
+    def _sma(self, window):
+        return self._node(('sma', window), lambda close: rolling_mean(close, window), [self._price('Close')])
+
+    def _std(self, window):
+        return self._node(('std', window), lambda close: rolling_std(close, window), [self._price('Close')])
+
+    def _ema(self, window):
+        return self._node(('ema', window), lambda close: ema(close, window), [self._price('Close')])
+
+    def _macd(self, short_window, long_window):
+        return self._node(('macd', short_window, long_window), lambda short, long: short - long,
+                          [self._ema(short_window), self._ema(long_window)])
+
+    def _add_outputs(self, name, parameters):
+        suffix = '_'.join(str(parameter) for parameter in parameters)
+
+        if name == 'sma':
+            self.outputs[f'sma{suffix}'] = self._sma(*parameters)
+
+        elif name == 'ema':
+            self.outputs[f'ema{suffix}'] = self._ema(*parameters)
+
+        elif name == 'macd':
+            short_window, long_window, signal_window = parameters
+            macd_line = self._macd(short_window, long_window)
+            self.outputs[f'macd{suffix}'] = macd_line
+            self.outputs[f'signal{suffix}'] = self._node(
+                ('signal',) + parameters, lambda line: ema(line, signal_window), [macd_line])
+
+        elif name == 'bb':
+            window, = parameters
+            needs = [self._sma(window), self._std(window)]
+            self.outputs[f'lower_band{suffix}'] = self._node(('lower_band', window), lambda sma, std: sma - (std * 2), needs)
+            self.outputs[f'upper_band{suffix}'] = self._node(('upper_band', window), lambda sma, std: sma + (std * 2), needs)
+
+        elif name == 'rsi':
+            window, = parameters
+            self.outputs[f'rsi{suffix}'] = self._node(
+                ('rsi', window), lambda close: BatchIndicators(close).rsi(window), [self._price('Close')])
+
+        elif name == 'atr':
+            window, = parameters
+            self.outputs[f'atr{suffix}'] = self._node(
+                ('atr', window), lambda close, high, low: BatchIndicators(close, high, low).atr_series(window),
+                [self._price('Close'), self._price('High'), self._price('Low')])
+
+    # ==================================================================================================
+    #                           RUNNING
+    # ==================================================================================================
+
+    def calculate(self, prices):
+        '''
+        Runs the graph on a dictionary of 2-D arrays (field -> dates x tickers, every ticker's prices at the bottom,
+        see right_align) and returns output name -> 2-D array
+        '''
+        results = {}
+
+        for key, (calculate, needs) in self.nodes.items():
+            if key[0] == 'price':
+                results[key] = prices[key[1]]
+            else:
+                results[key] = calculate(*(results[need] for need in needs))
+
+        return {name: results[key] for name, key in self.outputs.items()}
+
+    def run(self, data):
+        '''
+        Calculates the spec for one ticker's dataframe or a PricePanel.
+        Returns a dataframe with the same index as data and one column per output (for a panel (output, ticker) columns)
+        '''
+        fields = {key[1] for key in self.nodes if key[0] == 'price'}
+
+        if isinstance(data, pd.DataFrame):
+            prices = {field: data[field].to_numpy(dtype=np.float64)[:, None] for field in fields}
+            results = self.calculate(prices)
+
+            return pd.DataFrame({name: values[:, 0] for name, values in results.items()}, index=data.index)
+
+        # a panel: move every ticker's prices to the bottom, so gaps in the shared calendar don't change the results,
+        # and put them back on the panel's dates afterwards
+        valid = ~np.isnan(data.close)
+        results = self.calculate({field: right_align(data.arrays[field], valid) for field in fields})
+
+        return pd.concat({name: pd.DataFrame(restore_alignment(values, valid), index=data.dates, columns=data.tickers)
+                          for name, values in results.items()}, axis=1)
@@ -6,8 +6,11 @@ briefly explained here but for further insight it might be sensible to look at a
 
 
 # chatgpt was used to suggest equations for suitable indicatiors
+import numpy as np
 import pandas as pd
 
+from core.batch_indicators import right_align, snapshot
+
 
 class Indicators:
     '''
@@ -21,45 +24,75 @@ class Indicators:
     def __init__(self, data):
         '''
         Add data to self, so all indicators can access it if necessary
+        data can be one ticker's dataframe or a PricePanel, with a panel every indicator is calculated for all tickers
+        at once and comes back as dataframe (dates x tickers) instead of a series
+
+        Every result is calculated only once per instance and then served from a cache (sma(100) for the verdict is the
+        same series as sma(100) for the heatmap, macd() reuses ema(12) and ema(26) ...). The cache is dropped when
+        data is replaced, results that came out of the cache should not be changed in place
         '''
 
         self.data = data
 
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        # new data, so everything calculated for the old data is useless
+        self._data = data
+        self._cache = {}
+
+    def _cached(self, key, calculate):
+        '''Returns the cached result for key (method name, parameters), calculate() only runs the first time'''
+        if key not in self._cache:
+            self._cache[key] = calculate()
+
+        return self._cache[key]
+
     def sma(self, window):
         """Calculate Simple Moving Average (SMA)"""
 
         # SMA = sum of closing prices over the window / window size (SMA30 and 100 are used, so window=100)
         # https://medium.com/analytics-vidhya/sma-short-moving-average-in-python-c656956a08f8
-        sma = self.data['Close'].rolling(window=window).mean()
-
-        return sma
+        return self._cached(('sma', window), lambda: self.data['Close'].rolling(window=window).mean())
 
     # , data, short_ma, long_ma)
     def moving_average_crossover(self, short_ma, long_ma):
-        """Calculate Moving Average Crossover Signals"""
-
-        # empty DataFrame to store crossover signals
-        crossings = pd.DataFrame()
-        crossings_data = []
+        """
+        Calculate Moving Average Crossover Signals
+        Returns a series of 'Golden Cross' / 'Death Cross' indexed by date (empty if the averages never cross).
+        With a panel (short_ma and long_ma are dataframes of dates x tickers) all tickers are checked at once and the
+        index is (Date, Ticker)
+        """
 
         # A golden cross occurs when a short-term moving average crosses above a long-term moving average, indicating a potential bullish trend.
-        for i in range(1, len(self.data)):
-            if i < len(self.data) - 1:
+        # day i is a crossing if the averages are on opposite sides the day before and the day after, so instead of looping
+        # over every day we compare the whole series shifted by one day in both directions (NaN compares as False)
+        length = len(self.data)
+        short_values = np.asarray(short_ma, dtype=np.float64)[:length]
+        long_values = np.asarray(long_ma, dtype=np.float64)[:length]
 
-                if short_ma.iloc[i+1] > long_ma.iloc[i+1] and short_ma.iloc[i-1] <= long_ma.iloc[i-1]:
-                    crossings_data.append((self.data.index[i], 'Golden Cross'))
+        short_after, long_after = short_values[2:], long_values[2:]
+        short_before, long_before = short_values[:-2], long_values[:-2]
 
-                elif short_ma.iloc[i+1] < long_ma.iloc[i+1] and short_ma.iloc[i-1] >= long_ma.iloc[i-1]:
-                    crossings_data.append((self.data.index[i], 'Death Cross'))
+        golden = (short_after > long_after) & (short_before <= long_before)
+        death = (short_after < long_after) & (short_before >= long_before) & ~golden
 
-                else:
-                    continue
+        crossing = golden | death
+        labels = np.where(golden[crossing], 'Golden Cross', 'Death Cross').astype(object)
 
-        if crossings_data:
-            crossings = pd.DataFrame(crossings_data, columns=[
-                'Date', 'Crossover Type']).set_index('Date')
+        if crossing.ndim == 1:
+            # + 1 because the comparison starts at the second day
+            dates = self.data.index[np.flatnonzero(crossing) + 1]
+            index = pd.Index(dates, name='Date')
+        else:
+            rows, columns = np.nonzero(crossing)
+            tickers = short_ma.columns if isinstance(short_ma, pd.DataFrame) else pd.Index(self.data.tickers)
+            index = pd.MultiIndex.from_arrays([self.data.index[rows + 1], tickers[columns]], names=['Date', 'Ticker'])
 
-        return crossings['Crossover Type']
+        return pd.Series(labels, index=index, name='Crossover Type')
 
     def bollinger_bands(self, window=30):
         """Calculate Bollinger Bands"""
@@ -68,6 +101,10 @@ class Indicators:
         # The upper band is typically 2 standard deviations above the SMA, and the lower band is 2 standard deviations below the SMA.
         # typically if the current market price is near/above the upper band, the asset is considered overbought
         # if the price is near/below the lower band, the asset is considered oversold
+        return self._cached(('bollinger_bands', window), lambda: self._bollinger_bands(window))
+
+    def _bollinger_bands(self, window):
+        # the middle band is the (cached) sma, so sma(30) and bollinger_bands(30) share it
         sma = self.sma(window)
         # https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.std.html
         std = self.data['Close'].rolling(window=window).std()
@@ -82,6 +119,9 @@ class Indicators:
         # RSI = 100 - (100 / (1 + RS))
         # RS = Average Gain / Average Loss over the specified window
         # Typically, an RSI above 70 indicates overbought conditions, while an RSI below 30 indicates oversold conditions.
+        return self._cached(('rsi', window), lambda: self._rsi(window))
+
+    def _rsi(self, window):
         delta = self.data['Close'].diff()
         gain = (delta.where(delta > 0, 0)).rolling(window=window).mean()
         loss = (-delta.where(delta < 0, 0)).rolling(window=window).mean()
@@ -105,14 +145,18 @@ class Indicators:
         # EMA gives more weight to recent prices, making it more responsive to new information.
         # EMA_today = (Price_today * (smoothing / (1 + window))) + (EMA_yesterday * (1 - (smoothing / (1 + window))))
         # A common smoothing factor is 2.
-        ema = self.data['Close'].ewm(span=window, adjust=False).mean()
-        return ema
+        return self._cached(('ema', window), lambda: self.data['Close'].ewm(span=window, adjust=False).mean())
 
     def macd(self, short_window=12, long_window=26, signal_window=9):
         """Calculate Moving Average Convergence Divergence (MACD)"""
 
         # MACD = 12-day EMA - 26-day EMA
         # Signal Line = 9-day EMA of MACD
+        return self._cached(('macd', short_window, long_window, signal_window),
+                            lambda: self._macd(short_window, long_window, signal_window))
+
+    def _macd(self, short_window, long_window, signal_window):
+        # both emas come from the cache if they were calculated before (and are cached for later otherwise)
         ema_short = self.ema(short_window)
         ema_long = self.ema(long_window)
         macd_line = ema_short - ema_long
@@ -124,15 +168,17 @@ class Indicators:
     def atr(self, window=14):
         """Average true range"""
 
+        return self._cached(('atr', window), lambda: self._atr(window))
+
+    def _atr(self, window):
         # Average true range is an indicator for market volatility and therefore risk
 
-        true_ranges = pd.DataFrame()
-        true_ranges['H-L'] = self.data['High'] - self.data['Low']
-        true_ranges['H-PC'] = abs(self.data['High'] -
-                                  self.data['Close'].shift(1))
-        true_ranges['L-PC'] = abs(self.data['Low'] -
-                                  self.data['Close'].shift(1))
-        true_range = true_ranges.max(axis=1)
+        # true range is the biggest of H-L, H-PC and L-PC, fmax skips NaN like max() does (first day has no previous close)
+        # and also works element-wise for a whole panel
+        high_low = self.data['High'] - self.data['Low']
+        high_previous_close = abs(self.data['High'] - self.data['Close'].shift(1))
+        low_previous_close = abs(self.data['Low'] - self.data['Close'].shift(1))
+        true_range = np.fmax(high_low, np.fmax(high_previous_close, low_previous_close))
 
         atr = true_range.rolling(window=window).mean()
 
@@ -141,4 +187,25 @@ class Indicators:
 
         return atr_scaled.iloc[-1]
 
+    def snapshot(self, **windows):
+        """
+        Only the last two values of every indicator the verdict needs, as IndicatorSnapshot (fields are (previous, latest)).
+        It's calculated from the shortest tail of the data that gives the same values, so long histories don't cost more.
+        windows can change the defaults, e.g. snapshot(sma_windows=(20, 50)), see batch_indicators.snapshot
+        """
+        key = ('snapshot',) + tuple(sorted(windows.items()))
+
+        return self._cached(key, lambda: self._snapshot(windows))
+
+    def _snapshot(self, windows):
+        close, high, low = (np.asarray(self.data[field], dtype=np.float64) for field in ('Close', 'High', 'Low'))
+
+        if close.ndim == 1:
+            return snapshot(close[:, None], high[:, None], low[:, None], **windows).ticker(0)
+
+        # a panel: move every ticker's latest price into the last row first
+        valid = ~np.isnan(close)
+
+        return snapshot(*(right_align(values, valid) for values in (close, high, low)), **windows)
+
     # Further indicators can be added here in the future
@@ -2,21 +2,26 @@
 Creates a networking graph with clustering via plotly, so everything is interactable.
 Further explanation can be found in the notebook
 """
-import pandas as pd
 import networkx as nx
 import plotly.graph_objects as go
 import numpy as np
-import urllib.request
+
+from core.correlation_engine import EDGE_COLUMNS, edges_from_matrix
+from data.universe import sp500_universe
 
 # suggestion by ChatGPT in a brainstorming session, explained it in the corresponding notebook
 from networkx.algorithms import community as nx_comm
 from scipy.spatial import ConvexHull
 import plotly.io as pio
 
+# lowest threshold of the sliders, the saved edge files keep every pair above it
+MIN_THRESHOLD = 0.3
+
 
 class network_graph:
     '''
     This class creates a networking graph if you enter a correlation dataframe and threshold via plotly
+    correlations can be the full correlation matrix or an edge table (ticker_a, ticker_b, corr) with only the strong pairs
     '''
 
     def __init__(self, correlations, threshold):
@@ -28,37 +33,12 @@ class network_graph:
 
     def get_company_info(self):
         '''
-        Fetches company names and sectors for S&P 500 companies from Wikipedia
+        Gets company names and sectors for S&P 500 companies from the universe registry (Wikipedia table)
         We need that for the hover text to get further insight and judge the eg clusters better
         '''
 
-        # fetch the wikipedia page
-        url = 'https://en.wikipedia.org/wiki/List_of_S%26P_500_companies'
-        req = urllib.request.Request(
-            url, headers={'User-Agent': 'Mozilla/5.0'})
-        html = urllib.request.urlopen(req).read()
-        tables = pd.read_html(html)
-
-        # extract company names, sectors and tickers, also more robust by checking all tables
-        for table in tables:
-            try:
-                company_names = table['Security'].tolist()
-                company_sector = table['GICS Sector'].tolist()
-                sp500_tickers = table['Symbol'].tolist()
-            except Exception:
-                pass
-
-        # wikipedia uses dots in some ticker symbols, but yfinance needs dashes (e.g. BF.B -> BF-B)
-        sp500_tickers = [t.replace(".", "-") for t in sp500_tickers]
-
-        # create a dictionary mapping tickers to names and sectors
-        self.company_info = {}
-        for i, ticker in enumerate(sp500_tickers):
-            # map ticker to name and sector
-            self.company_info[ticker] = {
-                'name': company_names[i],
-                'sector': company_sector[i]
-            }
+        # the universe registry parsed the wikipedia table already, so this does not touch the network
+        self.company_info = sp500_universe.company_info()
 
     def create_network(self):
         '''
@@ -69,17 +49,20 @@ class network_graph:
 
         self.G = nx.Graph()
 
-        # add nodes to G
-        nodes = self.correlations.index.to_list()
+        # the matrix is turned into the edge table of its strong pairs, instead of looking at every pair one by one
+        if set(EDGE_COLUMNS).issubset(self.correlations.columns):
+            edges = self.correlations
+        else:
+            edges = edges_from_matrix(self.correlations, self.threshold)
+
+        # add nodes to G (also the ones without any edge)
+        nodes = edges.attrs.get('tickers') or list(dict.fromkeys(edges['ticker_a'].to_list() + edges['ticker_b'].to_list()))
 
         self.G.add_nodes_from(nodes)
 
         # add edges based on threshold
-        for i in range(len(nodes)):
-            for j in range(i+1, len(nodes)):
-                corr_value = self.correlations.iloc[i, j]
-                if abs(corr_value) >= self.threshold:
-                    self.G.add_edge(nodes[i], nodes[j], weight=corr_value)
+        edges = edges[edges['corr'].abs() >= self.threshold]
+        self.G.add_weighted_edges_from(zip(edges['ticker_a'], edges['ticker_b'], edges['corr'].astype(float)))
 
     # threshold is chosen for best performance and visibility
 
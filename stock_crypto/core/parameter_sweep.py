@@ -0,0 +1,240 @@
+'''
+Parameter sweeps for the verdict: the thresholds (2/4/8 % ma distance, 30/50/70 rsi, the +-10/+-18 buckets, the ATR
+multipliers ...) and the indicator windows are guesses, the sweep runs a backtest for many combinations of them on
+historical prices and writes the results to a parquet table.
+The prices are put into shared memory once and every worker process attaches to them, so 8 workers don't mean 8
+copies of the panel. Results are written in parts while the sweep runs and finished combinations are skipped on the
+next run, so an interrupted sweep just continues where it stopped.
+'''
+
+import hashlib
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from core.backtest import Backtest
+from core.price_panel import attach_worker, worker_panel
+from core.verdict_engine import VerdictEngine, VerdictRules
+
+
+SWEEP_PATH = Path("stock_crypto/data_saved/sweeps")
+
+# every parameter of the sweep with its default (the values the verdict uses today)
+PARAMETERS = {
+    'ma_short_low': 2, 'ma_short_high': 4,
+    'ma_long_low': 4, 'ma_long_high': 8,
+    'rsi_low': 30, 'rsi_middle': 50, 'rsi_high': 70,
+    'bollinger_low': 0.2, 'bollinger_high': 0.8,
+    'atr_low': 30, 'atr_high': 70,
+    'atr_low_multiplier': 1.2, 'atr_high_multiplier': 0.8,
+    'buy_score': 10, 'strong_score': 18,
+    'sma_short': 30, 'sma_long': 100,
+    'ema_short': 12, 'ema_long': 26,
+    'macd_short': 12, 'macd_long': 26, 'macd_signal': 9,
+    'bollinger_window': 30, 'rsi_window': 14, 'atr_window': 14
+}
+
+
+def parameter_id(parameters):
+    '''Short id of a parameter combination, the same combination (with the defaults filled in) always gets the same id'''
+    parameters = {**PARAMETERS, **parameters}
+    text = json.dumps({key: parameters[key] for key in sorted(parameters)}, default=float)
+
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+def parameter_grid(grid):
+    '''
+    Every combination of a grid, e.g. {'rsi_low': [20, 30], 'buy_score': [8, 10, 12]} gives 6 combinations.
+    Parameters that aren't in the grid keep their default
+    '''
+    keys = list(grid)
+
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[key] for key in keys))]
+
+
+def parameter_sample(space, samples, seed=None):
+    '''
+    Random combinations: space is parameter -> list of values to pick from or (low, high) tuple for a uniform float,
+    e.g. {'rsi_low': [20, 25, 30], 'bollinger_low': (0.1, 0.3)}. The same seed gives the same combinations
+    '''
+    rng = np.random.default_rng(seed)
+    combinations = []
+
+    for _ in range(samples):
+        combination = {}
+        for key, values in space.items():
+            if isinstance(values, tuple):
+                combination[key] = float(rng.uniform(*values))
+            else:
+                combination[key] = values[rng.integers(len(values))]
+        combinations.append(combination)
+
+    return combinations
+
+
+def engine_from_parameters(parameters):
+    '''The VerdictEngine for a parameter combination, missing parameters get their default'''
+    unknown = set(parameters) - set(PARAMETERS)
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters: {', '.join(sorted(unknown))}")
+
+    p = {**PARAMETERS, **parameters}
+    rules = VerdictRules(ma_short_thresholds=(p['ma_short_low'], p['ma_short_high']),
+                         ma_long_thresholds=(p['ma_long_low'], p['ma_long_high']),
+                         rsi_thresholds=(p['rsi_low'], p['rsi_middle'], p['rsi_high']),
+                         bollinger_thresholds=(p['bollinger_low'], p['bollinger_high']),
+                         atr_thresholds=(p['atr_low'], p['atr_high']),
+                         atr_multipliers=(p['atr_low_multiplier'], p['atr_high_multiplier']),
+                         buy_score=p['buy_score'], strong_score=p['strong_score'])
+
+    return VerdictEngine(rules, sma_windows=(int(p['sma_short']), int(p['sma_long'])),
+                         ema_windows=(int(p['ema_short']), int(p['ema_long'])),
+                         macd_windows=(int(p['macd_short']), int(p['macd_long']), int(p['macd_signal'])),
+                         bollinger_window=int(p['bollinger_window']), rsi_window=int(p['rsi_window']),
+                         atr_window=int(p['atr_window']))
+
+
+def evaluate(panel, parameters, backtest_options=None):
+    '''Backtest of the verdicts of one parameter combination, returns the backtest metrics'''
+    engine = engine_from_parameters(parameters)
+
+    return Backtest(panel, engine.history(panel)['verdict'], **(backtest_options or {})).metrics
+
+
+def _evaluate_in_worker(parameters, backtest_options):
+    return evaluate(worker_panel(), parameters, backtest_options)
+
+
+class ParameterSweep:
+    '''
+    Runs backtests for many parameter combinations and keeps the results in a parquet table.
+    For example: sweep = ParameterSweep(panel, 'rsi_thresholds')
+                 sweep.run(parameter_grid({'rsi_low': [20, 25, 30], 'rsi_high': [70, 75, 80]}))
+                 sweep.results().sort_values('sharpe')
+
+    Every finished combination is one row: id, the parameters (all of them, with the defaults filled in) and the
+    backtest metrics. Rows are written to part files every flush_every results, running the same sweep again only
+    runs the combinations that aren't in the table yet. Combinations that fail are printed and not written,
+    so they are tried again on the next run
+    '''
+
+    def __init__(self, panel, name='sweep', path=SWEEP_PATH, workers=None, backtest_options=None, flush_every=20):
+        self.panel = panel
+        self.path = Path(path) / name
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+        self.backtest_options = backtest_options or {}
+        self.flush_every = flush_every
+
+    # ==================================================================================================
+    #                           RESULTS TABLE
+    # ==================================================================================================
+
+    def results(self):
+        '''All results of the sweep so far as dataframe (empty if nothing was run yet)'''
+        parts = sorted(self.path.glob('part-*.parquet'))
+
+        if not parts:
+            return pd.DataFrame()
+
+        return pd.concat([pd.read_parquet(part) for part in parts], ignore_index=True)
+
+    def finished_ids(self):
+        results = self.results()
+
+        return set(results['id']) if not results.empty else set()
+
+    def _write(self, rows):
+        '''Writes rows as new part file, through a temporary file so an interrupted write never leaves half a part'''
+        if not rows:
+            return
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        part = self.path / f"part-{time.time_ns()}-{os.getpid()}.parquet"
+        temporary = part.with_suffix('.tmp')
+
+        pd.DataFrame(rows).to_parquet(temporary)
+        os.replace(temporary, part)
+
+    def _row(self, parameters, metrics):
+        return {'id': parameter_id(parameters), **{**PARAMETERS, **parameters},
+                **{key: float(value) for key, value in metrics.items()}}
+
+    # ==================================================================================================
+    #                           RUNNING
+    # ==================================================================================================
+
+    def run(self, combinations):
+        '''
+        Runs every combination that isn't finished yet (in parallel if workers > 1) and returns all results.
+        Printing progress every flush_every results
+        '''
+        finished = self.finished_ids()
+        todo = {}
+        for parameters in combinations:
+            engine_from_parameters(parameters)  # unknown parameters should fail here and not in a worker
+            todo.setdefault(parameter_id(parameters), parameters)
+        todo = [parameters for key, parameters in todo.items() if key not in finished]
+
+        print(f"Sweep {self.path.name}: {len(todo)} combinations to run, {len(finished)} already done")
+
+        if self.workers <= 1 or len(todo) <= 1:
+            self._run_serial(todo)
+        else:
+            self._run_parallel(todo)
+
+        return self.results()
+
+    def _run_serial(self, todo):
+        rows = []
+
+        for parameters in todo:
+            try:
+                rows.append(self._row(parameters, evaluate(self.panel, parameters, self.backtest_options)))
+            except Exception as e:
+                print(f"Error in sweep for {parameters}: {e}")
+
+            if len(rows) >= self.flush_every:
+                self._write(rows)
+                rows = []
+
+        self._write(rows)
+
+    def _run_parallel(self, todo):
+        blocks, description = self.panel.to_shared()
+        rows = []
+        done = 0
+
+        executor = ProcessPoolExecutor(max_workers=self.workers, initializer=attach_worker, initargs=(description,))
+
+        try:
+            futures = {executor.submit(_evaluate_in_worker, parameters, self.backtest_options): parameters
+                       for parameters in todo}
+
+            for future in as_completed(futures):
+                parameters = futures[future]
+                done += 1
+
+                try:
+                    rows.append(self._row(parameters, future.result()))
+                except Exception as e:
+                    print(f"Error in sweep for {parameters}: {e}")
+
+                if len(rows) >= self.flush_every:
+                    self._write(rows)
+                    rows = []
+                    print(f"Sweep {self.path.name}: {done}/{len(todo)} done")
+        finally:
+            # on an interruption the combinations that haven't started are dropped, whatever finished is kept
+            executor.shutdown(cancel_futures=True)
+            self._write(rows)
+
+            for block in blocks:
+                block.close()
+                block.unlink()
@@ -1,73 +1,196 @@
+import time
+import numpy as np
 import streamlit as st  # need streamlit for session_state
 from data.fetch_data import stock_data
+from core.batch_indicators import forward_fill
+from core.market_screener import heatmap_portfolio
+from core.price_panel import PricePanel
 import pandas as pd
 
 sst = st.session_state
 
-# create empty lists to insert into dataframe - not very pretty but it works
-ticker_list = []
-amount_list = []
-buy_in_list = []
-current_price_list = []
-change_list = []
-invested_overall_list = []
-value_now_list = []
-overall_profit_list = []
+HOLDING_COLUMNS = ["Ticker", "Amount", "Buy-In"]
+PORTFOLIO_COLUMNS = ["Ticker", "Amount", "Buy-In", "Current Price", "Change%",
+                     "Invested overall", "Value Now", "Overall profit"]
+
+
+def value_holdings(holdings, panel):
+    '''
+    Current price, change, invested money, value and profit of every holding at once.
+    holdings is a dataframe with Ticker, Amount and Buy-In, the prices come from the panel (latest close of every ticker)
+    '''
+    tickers = holdings['Ticker'].to_list()
+    amount = holdings['Amount'].to_numpy(dtype=np.float64)
+    buy_in = holdings['Buy-In'].to_numpy(dtype=np.float64)
+
+    # latest close of every holding, NaN for holdings the panel doesn't have (column -1) or that have no price
+    columns = np.array([panel.columns.get(ticker, -1) for ticker in tickers], dtype=int)
+    current_price = np.full(len(tickers), np.nan)
+    if panel.tickers:
+        rows = np.where(columns >= 0, panel.last_valid_rows()[columns], -1)
+        current_price = np.where(rows >= 0, panel.close[rows, columns], np.nan)
+
+    current_price = np.round(current_price, 2)
+    invested = np.round(amount * buy_in, 2)
+    value_now = np.round(current_price * amount, 2)
+
+    return pd.DataFrame({'Ticker': tickers,
+                         'Amount': holdings['Amount'].to_list(),
+                         'Buy-In': holdings['Buy-In'].to_list(),
+                         'Current Price': current_price,
+                         'Change%': np.round((current_price - buy_in) / buy_in * 100, 2),
+                         'Invested overall': invested,
+                         'Value Now': value_now,
+                         'Overall profit': np.round(value_now - invested, 2)})
+
+
+class Portfolio:
+    '''
+    The holdings of a portfolio as one table (Ticker, Amount, Buy-In), one row per ticker.
+    For example: portfolio = Portfolio()
+                 portfolio.add('AAPL', 10, 150.0)
+                 portfolio.equity_curve(panel)   -> value, invested money, P&L and drawdown for every day of the panel
+                 portfolio.to_dict()             -> plain dictionary, Portfolio.from_dict() turns it back
+
+    The portfolio lives in the session_state (sst.portfolio), so every user session has its own
+    '''
+
+    def __init__(self, holdings=None):
+        if holdings is None:
+            holdings = pd.DataFrame({'Ticker': pd.Series(dtype=object), 'Amount': pd.Series(dtype=np.float64),
+                                     'Buy-In': pd.Series(dtype=np.float64)})
+
+        self.holdings = holdings[HOLDING_COLUMNS].reset_index(drop=True)
+
+    def __contains__(self, ticker):
+        return ticker in set(self.holdings['Ticker'])
+
+    def __len__(self):
+        return len(self.holdings)
+
+    @property
+    def tickers(self):
+        return self.holdings['Ticker'].to_list()
+
+    def add(self, ticker, amount, buy_in):
+        '''Returns a new portfolio with the holding added (the same portfolio if the ticker is already in it)'''
+        if ticker in self:
+            return self
+
+        row = pd.DataFrame({'Ticker': [ticker], 'Amount': [amount], 'Buy-In': [buy_in]})
+
+        return Portfolio(pd.concat([self.holdings, row], ignore_index=True) if len(self) else row)
+
+    def remove(self, ticker):
+        '''Returns a new portfolio without the ticker'''
+        return Portfolio(self.holdings[self.holdings['Ticker'] != ticker])
+
+    def equity_curve(self, panel=None, period='5y'):
+        '''
+        Value of the portfolio on every day of the panel (or the last period if no panel is given), with the money
+        invested, the profit/loss and the drawdown from the highest value so far.
+        The daily values are one matrix product of the prices (dates x holdings) and the amounts, gaps in the prices
+        keep the last close. The curve starts on the first day every holding has a price (a recently listed stock
+        would otherwise show up as a jump), holdings without any price are left out of value and invested money
+        and listed in attrs['missing']
+        '''
+        if panel is None:
+            panel = PricePanel.from_download(stock_data.fetch_multiple_stocks_data(self.tickers, period, '1d'))
+
+        # holdings in the order of the panel columns, holdings without prices are left out
+        panel = panel.select(self.tickers)
+        valid = ~np.isnan(panel.close)
+        priced = [ticker for ticker, has_price in zip(panel.tickers, valid.any(axis=0)) if has_price]
+        panel = panel.select(priced)
+        valid = ~np.isnan(panel.close)
+
+        holdings = self.holdings.set_index('Ticker').loc[panel.tickers]
+        amounts = holdings['Amount'].to_numpy(dtype=np.float64)
+        invested = float((holdings['Amount'] * holdings['Buy-In']).sum())
+
+        # first day on which every holding has a price
+        first = int(np.argmax(valid, axis=0).max()) if panel.tickers else len(panel)
+        value = (forward_fill(panel.close) @ amounts)[first:]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            drawdown = value / np.maximum.accumulate(value) - 1
+
+        curve = pd.DataFrame({'Value': value, 'Invested': invested, 'P&L': value - invested, 'Drawdown': drawdown},
+                             index=panel.dates[first:])
+        curve.attrs['missing'] = [ticker for ticker in self.tickers if ticker not in set(panel.tickers)]
+
+        return curve
+
+    def to_dict(self):
+        '''The holdings as plain dictionary (json-serialisable)'''
+        return {column: self.holdings[column].to_list() for column in HOLDING_COLUMNS}
+
+    @classmethod
+    def from_dict(cls, state):
+        return cls(pd.DataFrame({column: state[column] for column in HOLDING_COLUMNS}))
+
+
+class PortfolioValuation:
+    '''
+    Values the whole portfolio with one batched download (most of the time served from the local store, without any
+    network call) and calculates the heatmap of all holdings in one vectorized pass.
+    The result is kept until the holdings or the market data change, so a page interaction that changes nothing
+    doesn't calculate anything again. The prices themselves are only looked at again after refresh_seconds (the same
+    time the local store keeps data as up to date), before that a rerun with the same holdings doesn't read anything.
+    For example: positions, heatmap = sst.portfolio_valuation.value(holdings)
+    '''
+
+    def __init__(self, period='6mo', refresh_seconds=60):
+        self.period = period
+        self.refresh_seconds = refresh_seconds
+        self._key = None
+        self._checked_at = None
+        self._result = None
+
+    def panel(self, tickers):
+        '''Prices of all holdings in one batch'''
+        return PricePanel.from_download(stock_data.fetch_multiple_stocks_data(tickers, self.period, '1d'))
 
+    def value(self, holdings):
+        '''Returns the portfolio table (PORTFOLIO_COLUMNS) and the heatmap of the holdings'''
+        holdings_key = tuple(map(tuple, holdings[HOLDING_COLUMNS].to_numpy().tolist()))
 
-# create a session_state of the portfolio, so refreshing will not erase all data (sst used to reduce effort)
-if 'portfolio_dataframe' not in sst:
-    sst.portfolio_dataframe = pd.DataFrame(columns=["Ticker", "Amount", "Buy-In", "Current Price", "Change%",
-                                                    "Invested overall", "Value Now", "Overall profit"])
+        # same holdings and the prices were checked a moment ago: nothing to read or download
+        if (self._key is not None and self._key[0] == holdings_key
+                and time.time() - self._checked_at < self.refresh_seconds):
+            return self._result
+
+        tickers = list(dict.fromkeys(holdings['Ticker'].to_list()))
+        panel = self.panel(tickers)
+        self._checked_at = time.time()
+
+        # new market data means a new last bar (or a changed last close for a bar that is still open)
+        key = (holdings_key, panel.dates[-1] if len(panel) else None,
+               panel.close[-1].tobytes() if len(panel) else b'')
+
+        if key != self._key:
+            self._result = (value_holdings(holdings, panel), heatmap_portfolio(holdings, panel))
+            self._key = key
+
+        return self._result
 
 
 def generate_portfolio(ticker, amount, buy_in):
     ''' Creates a dataframe with the user input for the portfolio '''
 
     # check if there is an entry for the ticker, pass if there is
-    if ticker not in ticker_list:
-
-        # get the most recent price as list (for the index) and as float (as output)
-        current_price_index = stock_data.fetch_stock_data(ticker, '1d', '1d')
-
-        # calculate indicators and round if necessary
-        # then insert into a list for the datafframe
-
-        current_price = float(current_price_index['Close'].iloc[-1])
-        current_price = round(current_price, 2)
-
-        price_change = ((current_price - buy_in) / buy_in) * 100
-        price_change = round(price_change, 2)
-
-        overall_bought = amount * buy_in
-        overall_bought = round(overall_bought, 2)
-
-        value_now = current_price * amount
-        value_now = round(value_now, 2)
+    if ticker not in sst.portfolio:
 
-        profit_per_stock = value_now - overall_bought
-        profit_per_stock = round(profit_per_stock, 2)
+        portfolio = sst.portfolio.add(ticker, amount, buy_in)
 
-        ticker_list.append(ticker)
-        amount_list.append(amount)
-        buy_in_list.append(buy_in)
-        value_now_list.append(value_now)
-        invested_overall_list.append(overall_bought)
-        change_list.append(price_change)
-        current_price_list.append(current_price)
+        # all holdings are valued together, so adding one doesn't mean a download for every holding
+        positions, _ = sst.portfolio_valuation.value(portfolio.holdings)
 
-        overall_profit_list.append(profit_per_stock)
+        if np.isnan(positions['Current Price'].iloc[-1]):
+            raise ValueError(f"No price for {ticker}")
 
         # create a dataframe that does'nt get deleted
-        sst.portfolio_dataframe = pd.DataFrame({'Ticker': ticker_list,
-                                                'Amount': amount_list,
-                                                'Buy-In': buy_in_list,
-                                                'Current Price': current_price_list,
-                                                'Change%': change_list,
-                                                'Invested overall': invested_overall_list,
-                                                'Value Now': value_now_list,
-                                                'Overall profit': overall_profit_list})
-    else:
-        pass
+        sst.portfolio = portfolio
+        sst.portfolio_dataframe = positions
 
     return sst.portfolio_dataframe
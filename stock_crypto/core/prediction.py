@@ -4,37 +4,57 @@ Implements logic for estimating future movements, aggregating indicator
 verdicts, and producing a consolidated prediction output.
 """
 
-from core.indicators import Indicators
+from core.indicator_pipeline import IndicatorPipeline
+import numpy as np
 import pandas as pd
 
 
+# the indicators the trend score is built from
+PREDICTION_INDICATORS = IndicatorPipeline("sma30, sma100, ema12, ema26, rsi14, bb(30), macd(12,26,9)")
+
+# days of history the ensemble draws its volatilities from (about one trading year)
+VOLATILITY_WINDOW = 252
+
+
 class Prediction:
     '''
     This class contains the prediction logic, it needs data, calculate the indicators, scales them, adds weights and
     adds it to the current price
+
+    With paths > 0 it also simulates that many random paths around the prediction (Monte Carlo) and puts the
+    percentiles of all paths for every predicted day into self.bands (columns p5, p25, ... and mean)
     '''
 
-    def __init__(self, data, timeframe):
+    def __init__(self, data, timeframe, paths=0, percentiles=(5, 25, 50, 75, 95), seed=None, chunk_size=64):
         self.data = data
         self.timeframe = timeframe
+        self.paths = paths
+        self.percentiles = percentiles
+        self.seed = seed
+        # number of days simulated at once, so 10000 paths never need more than 10000 x chunk_size numbers in memory
+        self.chunk_size = chunk_size
+        self.bands = None
 
         self.prediction()
 
+        if paths > 0:
+            self.ensemble()
+
     def retreive_data(self):
         '''
         It takes the data, calculates the indicators, scales them and creates a trend score, 
         indicating price movement for the day after
         '''
-        indicators = Indicators(self.data)
+        indicators = PREDICTION_INDICATORS.run(self.data)
         # I explained the idea in the notebook in notebooks/
 
-        sma_short = indicators.sma(30)
-        sma_long = indicators.sma(100)
-        ema_short = indicators.ema(12)
-        ema_long = indicators.ema(26)
-        rsi_14 = indicators.rsi(14)
-        lower_band, upper_band = indicators.bollinger_bands(30)
-        macd_line, signal_line = indicators.macd()
+        sma_short = indicators['sma30']
+        sma_long = indicators['sma100']
+        ema_short = indicators['ema12']
+        ema_long = indicators['ema26']
+        rsi_14 = indicators['rsi14']
+        lower_band, upper_band = indicators['lower_band30'], indicators['upper_band30']
+        macd_line, signal_line = indicators['macd12_26_9'], indicators['signal12_26_9']
 
         sma_short, sma_long = sma_short.align(sma_long, join='inner')
         sma_diff = (sma_short - sma_long) / sma_long
@@ -79,28 +99,65 @@ class Prediction:
             0.25 + rsi_score * 0.2 + bb_score * 0.2 + macd_score * 0.2
 
     def prediction(self):
-        '''Create a rough estimate of how the future price might develop'''
+        '''
+        Create a rough estimate of how the future price might develop.
+        The trend score only looks at the known data, so it's the same for every predicted day: it's calculated once
+        and the whole forecast is built in one go instead of adding one row per day
+        '''
         # copy data to avoid modifying original dataframe
         self.data_pred = self.data.copy()
 
         std = self.data_pred['Close'].rolling(window=30).std()
         std_val = min(std.iloc[-1], 10)
 
-        # predict the first 100 days for simplicity and as placeholder
+        if self.timeframe <= 0:
+            return
+
+        self.retreive_data()
+        self.step = step = self.trend_score * std_val * 0.1
+
+        # cumsum adds the step day after day, the same way the price would move one day at a time
+        closes = np.cumsum(np.concatenate([[self.data_pred['Close'].iloc[-1]], np.full(self.timeframe, step)]))[1:]
+
+        # the next business day after the last known date, from there on every business day
+        first_date = pd.bdate_range(start=self.data_pred.index[-1], periods=2)[1]
+        dates = pd.bdate_range(start=first_date, periods=self.timeframe)
+
+        # https://pandas.pydata.org/docs/reference/api/pandas.concat.html
+        self.data_pred = pd.concat([self.data_pred, pd.DataFrame({'Close': closes}, index=dates)])
+
+    def ensemble(self):
+        '''
+        Simulates self.paths random paths at once: every day each path moves by the same step as the prediction plus
+        some noise, with a volatility drawn from the 30 day volatilities (rolling std) of the last VOLATILITY_WINDOW
+        days, so calm and wild periods both show up. The volatilities are taken relative to the close of their day and
+        scaled to the current price (old dollar volatilities don't fit a price that moved a lot since), and capped at
+        10 like the step of the prediction. The paths are simulated chunk_size days at a time, only the last price of
+        every path is kept from one chunk to the next
+        '''
+        if self.timeframe <= 0:
+            return
+
+        close = self.data['Close']
+        relative = (close.rolling(window=30).std() / close).iloc[-VOLATILITY_WINDOW:].dropna().to_numpy()
+        if len(relative) == 0:
+            raise ValueError("The ensemble needs at least 30 days of data")
 
-        for i in range(self.timeframe):
+        volatility = np.minimum(relative * close.iloc[-1], 10)
 
-            self.retreive_data()
+        rng = np.random.default_rng(self.seed)
+        prices = np.full(self.paths, close.iloc[-1], dtype=np.float64)
+        bands = np.empty((self.timeframe, len(self.percentiles) + 1))
 
-            next_close = self.data_pred['Close'].iloc[-1] + \
-                self.trend_score * std_val * 0.1
+        for start in range(0, self.timeframe, self.chunk_size):
+            days = min(self.chunk_size, self.timeframe - start)
 
-            next_date = pd.bdate_range(
-                start=self.data_pred.index[-1], periods=2)[1]
+            sigma = rng.choice(volatility, size=(self.paths, days))
+            paths = prices[:, None] + np.cumsum(self.step + sigma * rng.standard_normal((self.paths, days)), axis=1)
 
-            # Create a new row as a DataFrame
-            new_row = pd.DataFrame({'Close': [next_close]},  index=[next_date])
+            bands[start:start + days, :-1] = np.percentile(paths, self.percentiles, axis=0).T
+            bands[start:start + days, -1] = paths.mean(axis=0)
+            prices = paths[:, -1]
 
-            # Concatenate the new row
-            # https://pandas.pydata.org/docs/reference/api/pandas.concat.html
-            self.data_pred = pd.concat([self.data_pred, new_row])
+        columns = [f'p{percentile}' for percentile in self.percentiles] + ['mean']
+        self.bands = pd.DataFrame(bands, index=self.data_pred.index[-self.timeframe:], columns=columns)
@@ -0,0 +1,225 @@
+'''
+The PricePanel keeps the prices of many tickers in one place: one 2-D NumPy array (dates x tickers) for each of
+Close, Open, High and Low, all on the same trading calendar. Instead of a dictionary with one dataframe per ticker,
+whole-universe calculations can work on the arrays directly and single tickers are just views into them.
+'''
+
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+
+FIELDS = ('Close', 'Open', 'High', 'Low')
+
+
+class PricePanel:
+    '''
+    Date-aligned prices for many tickers.
+    For example: panel = PricePanel.from_frames({'AAPL': aapl_data, 'MSFT': msft_data})
+                 panel.close           -> 2-D array, rows are panel.dates, columns are panel.tickers
+                 panel['Close']        -> the same array as dataframe (no copy)
+                 panel.view('AAPL')    -> AAPL close prices as 1-D view of the array (no copy)
+                 panel.frame('AAPL')   -> AAPL as the usual Close/Open/High/Low dataframe
+
+    Missing prices (e.g. before a company was listed) are NaN. The arrays are stored column by column
+    (Fortran order), so every ticker is one contiguous block of memory
+    '''
+
+    def __init__(self, dates, tickers, close, open=None, high=None, low=None):
+        self.dates = pd.DatetimeIndex(dates)
+        self.tickers = list(tickers)
+        # ticker -> column in the arrays
+        self.columns = {ticker: column for column, ticker in enumerate(self.tickers)}
+
+        shape = (len(self.dates), len(self.tickers))
+        self.arrays = {}
+        for field, values in zip(FIELDS, (close, open, high, low)):
+            if values is None:
+                values = np.full(shape, np.nan)
+            values = np.asfortranarray(values, dtype=np.float64)
+
+            if values.shape != shape:
+                raise ValueError(f"{field} has shape {values.shape}, expected {shape}")
+
+            self.arrays[field] = values
+
+    # ==================================================================================================
+    #                           CREATING PANELS
+    # ==================================================================================================
+
+    @classmethod
+    def from_frames(cls, frames):
+        '''
+        Builds a panel out of a dictionary of ticker: dataframe (the dfs from get_tickers() for example).
+        The trading calendar is the union of all dates, tickers without a bar on a date get NaN there
+        '''
+        frames = {ticker: data for ticker, data in frames.items() if data is not None and not data.empty}
+
+        if not frames:
+            return cls(pd.DatetimeIndex([]), [], np.empty((0, 0)))
+
+        arrays = {}
+        for field in FIELDS:
+            # concat aligns everything on the dates, the missing ones get NaN
+            aligned = pd.concat({ticker: data[field] if field in data else data['Close'] * np.nan
+                                 for ticker, data in frames.items()}, axis=1).sort_index()
+            arrays[field] = aligned
+
+        close = arrays['Close']
+        # dates where no ticker has a price are useless
+        keep = close.notna().any(axis=1).to_numpy()
+
+        return cls(close.index[keep], list(close.columns),
+                   *(arrays[field].to_numpy(dtype=np.float64)[keep] for field in FIELDS))
+
+    @classmethod
+    def from_download(cls, downloaded):
+        '''Builds a panel from the result of fetch_multiple_stocks_data (columns are ticker, field)'''
+        if downloaded is None or downloaded.empty:
+            return cls(pd.DatetimeIndex([]), [], np.empty((0, 0)))
+
+        tickers = list(dict.fromkeys(downloaded.columns.get_level_values(0)))
+
+        return cls.from_frames({ticker: downloaded[ticker] for ticker in tickers})
+
+    # ==================================================================================================
+    #                           ACCESS
+    # ==================================================================================================
+
+    @property
+    def close(self):
+        return self.arrays['Close']
+
+    @property
+    def open(self):
+        return self.arrays['Open']
+
+    @property
+    def high(self):
+        return self.arrays['High']
+
+    @property
+    def low(self):
+        return self.arrays['Low']
+
+    @property
+    def index(self):
+        '''The trading calendar, named like the dataframe attribute so the panel can be used like a dataframe'''
+        return self.dates
+
+    @property
+    def shape(self):
+        return self.close.shape
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __contains__(self, ticker):
+        return ticker in self.columns
+
+    def __getitem__(self, field):
+        '''panel['Close'] -> dataframe of dates x tickers, sharing memory with the array'''
+        return pd.DataFrame(self.arrays[field], index=self.dates, columns=self.tickers, copy=False)
+
+    def view(self, ticker, field='Close'):
+        '''Prices of one ticker as 1-D array, no copy is made'''
+        return self.arrays[field][:, self.columns[ticker]]
+
+    def series(self, ticker, field='Close'):
+        '''Prices of one ticker as series, no copy is made'''
+        return pd.Series(self.view(ticker, field), index=self.dates, name=field, copy=False)
+
+    def frame(self, ticker, dropna=True):
+        '''One ticker as Close/Open/High/Low dataframe like fetch_stock_data returns it, dates without a price are dropped'''
+        data = pd.DataFrame({field: self.view(ticker, field) for field in FIELDS}, index=self.dates)
+
+        if dropna:
+            data = data[data['Close'].notna()]
+
+        return data
+
+    def frames(self, dropna=True):
+        '''Iterates over (ticker, dataframe) for every ticker'''
+        for ticker in self.tickers:
+            yield ticker, self.frame(ticker, dropna)
+
+    def tail(self, rows):
+        '''
+        Panel of the last rows. The arrays are copies: the panel keeps its arrays column by column (Fortran order) and
+        a row slice of such an array isn't, so the constructor copies it
+        '''
+        return PricePanel(self.dates[-rows:], self.tickers,
+                          *(self.arrays[field][-rows:] for field in FIELDS))
+
+    def block(self, start, stop):
+        '''
+        Panel of the tickers start:stop (by column). The arrays are views of this panel without a copy, a column slice
+        of a Fortran-ordered array is still Fortran-ordered (writing into them changes this panel too)
+        '''
+        return PricePanel(self.dates, self.tickers[start:stop],
+                          *(self.arrays[field][:, start:stop] for field in FIELDS))
+
+    def select(self, tickers):
+        '''Panel with only some of the tickers (in that order)'''
+        tickers = [ticker for ticker in tickers if ticker in self.columns]
+        columns = [self.columns[ticker] for ticker in tickers]
+
+        return PricePanel(self.dates, tickers, *(self.arrays[field][:, columns] for field in FIELDS))
+
+    def last_valid_rows(self):
+        '''Row of the last close price of every ticker (-1 if a ticker has no prices at all)'''
+        valid = ~np.isnan(self.close)
+        last = len(self.dates) - 1 - np.argmax(valid[::-1], axis=0)
+
+        return np.where(valid.any(axis=0), last, -1)
+
+    # ==================================================================================================
+    #                           SHARED MEMORY
+    # ==================================================================================================
+
+    def to_shared(self):
+        '''
+        Copies the arrays into shared memory, so worker processes can use the prices without getting a copy each.
+        Returns the shared memory blocks (close and unlink them when the workers are done) and a small description
+        that can be sent to the workers, which get the panel back with PricePanel.attach(description)
+        '''
+        blocks = []
+        description = {'dates': self.dates, 'tickers': self.tickers, 'shape': self.shape, 'arrays': {}}
+
+        for field in FIELDS:
+            block = shared_memory.SharedMemory(create=True, size=max(self.arrays[field].nbytes, 1))
+            shared = np.ndarray(self.shape, dtype=np.float64, buffer=block.buf, order='F')
+            shared[:] = self.arrays[field]
+
+            blocks.append(block)
+            description['arrays'][field] = block.name
+
+        return blocks, description
+
+    @classmethod
+    def attach(cls, description):
+        '''Panel on top of the shared memory of to_shared, nothing is copied'''
+        blocks = [shared_memory.SharedMemory(name=description['arrays'][field]) for field in FIELDS]
+        arrays = [np.ndarray(description['shape'], dtype=np.float64, buffer=block.buf, order='F') for block in blocks]
+
+        panel = cls(description['dates'], description['tickers'], *arrays)
+        # the arrays are only valid as long as the blocks are open
+        panel.shared_blocks = blocks
+
+        return panel
+
+
+# the panel of a worker process, attached once when the worker starts (initializer=attach_worker)
+_worker_panel = None
+
+
+def attach_worker(description):
+    '''Initializer for process pools: attaches the worker to the shared panel of PricePanel.to_shared'''
+    global _worker_panel
+    _worker_panel = PricePanel.attach(description)
+
+
+def worker_panel():
+    '''The shared panel inside a worker process'''
+    return _worker_panel
@@ -0,0 +1,311 @@
+'''
+Streaming version of the Indicators class for live data (the 1 minute feed of the short term tab for example).
+Instead of recalculating every rolling window over the whole history when one new bar comes in, the StreamingIndicators
+keep running sums, the EMA values and the last window of prices and only move them forward by the new bars.
+The state can be turned into a dictionary (or json file) and loaded again, so it survives a restart of the app.
+'''
+
+import json
+import math
+import os
+import tempfile
+from collections import deque
+from pathlib import Path
+
+import pandas as pd
+
+
+STREAMING_PATH = Path("stock_crypto/data_saved/streaming")
+
+
+class _RollingWindow:
+    '''
+    The last window values with their running sum and sum of squares, for rolling means and standard deviations.
+    All sums are taken relative to a shift value (one of the values in the window), which keeps the sum of squares
+    precise for large prices. Every window updates the sums are recalculated from scratch, so rounding errors don't
+    pile up, that's still constant time per update on average
+    '''
+
+    def __init__(self, window, values=()):
+        self.window = window
+        self.values = deque(values, maxlen=window)
+        self._recalculate()
+
+    def _recalculate(self):
+        valid = [value for value in self.values if not math.isnan(value)]
+
+        self.missing = len(self.values) - len(valid)
+        self.shift = valid[0] if valid else 0.0
+        self.total = sum(value - self.shift for value in valid)
+        self.total_squares = sum((value - self.shift) ** 2 for value in valid)
+        self.updates = 0
+
+    def _add(self, value, sign):
+        if math.isnan(value):
+            self.missing += sign
+        else:
+            self.total += sign * (value - self.shift)
+            self.total_squares += sign * (value - self.shift) ** 2
+
+    def push(self, value):
+        if len(self.values) == self.window:
+            self._add(self.values[0], -1)
+
+        self.values.append(value)
+        self._add(value, 1)
+
+        self.updates += 1
+        if self.updates >= self.window:
+            self._recalculate()
+
+    @property
+    def full(self):
+        '''Like pandas rolling(): only a full window without missing values gives a result'''
+        return len(self.values) == self.window and self.missing == 0
+
+    def mean(self):
+        if not self.full:
+            return math.nan
+
+        return self.shift + self.total / self.window
+
+    def std(self):
+        '''Sample standard deviation (ddof=1) like pandas rolling().std()'''
+        if not self.full or self.window < 2:
+            return math.nan
+
+        variance = (self.total_squares - self.total ** 2 / self.window) / (self.window - 1)
+
+        return math.sqrt(max(variance, 0.0))
+
+
+class _EMA:
+    '''
+    Exponential moving average, same steps as pandas ewm(span=window, adjust=False).mean(), so the values are equal.
+    A missing price keeps the last value, but still counts as time passing (weight of the old value gets smaller)
+    '''
+
+    def __init__(self, window, value=math.nan, old_weight=1.0):
+        self.window = window
+        self.alpha = 2 / (window + 1)
+        self.value = value
+        self.old_weight = old_weight
+
+    def push(self, price):
+        if math.isnan(self.value):
+            # first price starts the average
+            if not math.isnan(price):
+                self.value = price
+            return self.value
+
+        self.old_weight *= 1 - self.alpha
+
+        if not math.isnan(price):
+            if self.value != price:
+                self.value = (self.old_weight * self.value + self.alpha * price) / (self.old_weight + self.alpha)
+            self.old_weight = 1.0
+
+        return self.value
+
+
+class StreamingIndicators:
+    '''
+    Keeps the indicators of one ticker up to date bar by bar, every update costs the same no matter how long the history is.
+    For example: streaming = StreamingIndicators()
+                 streaming.update(data)        -> indicators for every new bar in data (bars seen before are skipped)
+                 streaming.update(bar)         -> one bar (series or dictionary with Close, High and Low)
+                 streaming.latest()            -> {'sma30': ..., 'rsi': ..., 'atr': ...} of the last bar
+                 streaming.save(path), StreamingIndicators.load(path)
+
+    The values are the same as the last row of the Indicators methods on the whole history (ATR is scaled by the highest
+    ATR seen so far, just like Indicators.atr)
+    '''
+
+    def __init__(self, sma_windows=(30, 100), ema_windows=(12, 26), rsi_window=14, macd_windows=(12, 26, 9),
+                 bollinger_window=30, atr_window=14):
+        self.sma_windows = tuple(sma_windows)
+        self.ema_windows = tuple(ema_windows)
+        self.rsi_window = rsi_window
+        self.macd_windows = tuple(macd_windows)
+        self.bollinger_window = bollinger_window
+        self.atr_window = atr_window
+
+        self.sma = {window: _RollingWindow(window) for window in self.sma_windows}
+        self.ema = {window: _EMA(window) for window in set(self.ema_windows + self.macd_windows[:2])}
+        self.signal = _EMA(self.macd_windows[2])
+        self.bollinger = _RollingWindow(bollinger_window)
+        self.gains = _RollingWindow(rsi_window)
+        self.losses = _RollingWindow(rsi_window)
+        self.true_ranges = _RollingWindow(atr_window)
+        self.atr_max = math.nan
+
+        self.previous_close = math.nan
+        self.last_time = None
+        self.values = {}
+
+    # ==================================================================================================
+    #                           UPDATING
+    # ==================================================================================================
+
+    def _bars(self, bars):
+        '''Turns a dataframe, series or dictionary into (time, close, high, low) tuples'''
+        if isinstance(bars, pd.DataFrame):
+            close = bars['Close']
+            high = bars['High'] if 'High' in bars else close
+            low = bars['Low'] if 'Low' in bars else close
+            return zip(bars.index, close, high, low)
+
+        close = bars['Close']
+        time = getattr(bars, 'name', None) if isinstance(bars, pd.Series) else bars.get('Date')
+
+        return [(time, close, bars.get('High', close), bars.get('Low', close))]
+
+    def _push(self, close, high, low):
+        '''Moves every indicator forward by one bar'''
+        close, high, low = float(close), float(high), float(low)
+        values = {}
+
+        for window, sma in self.sma.items():
+            sma.push(close)
+            values[f'sma{window}'] = sma.mean()
+
+        for window, ema in self.ema.items():
+            ema.push(close)
+        for window in self.ema_windows:
+            values[f'ema{window}'] = self.ema[window].value
+
+        short_window, long_window, signal_window = self.macd_windows
+        values['macd'] = self.ema[short_window].value - self.ema[long_window].value
+        values['signal'] = self.signal.push(values['macd'])
+
+        self.bollinger.push(close)
+        middle, std = self.bollinger.mean(), self.bollinger.std()
+        values['lower_band'] = middle - std * 2
+        values['upper_band'] = middle + std * 2
+
+        # like close.diff().where(delta > 0, 0): a missing change counts as no gain and no loss
+        delta = close - self.previous_close
+        self.gains.push(delta if delta > 0 else 0.0)
+        self.losses.push(-delta if delta < 0 else 0.0)
+        average_gain, average_loss = self.gains.mean(), self.losses.mean()
+        if average_loss == 0:
+            values['rsi'] = 100.0 if average_gain > 0 else math.nan
+        else:
+            values['rsi'] = 100 - (100 / (1 + average_gain / average_loss))
+
+        # true range skips missing values like Indicators.atr does
+        ranges = [value for value in (high - low, abs(high - self.previous_close), abs(low - self.previous_close))
+                  if not math.isnan(value)]
+        self.true_ranges.push(max(ranges) if ranges else math.nan)
+        atr = self.true_ranges.mean()
+        if not math.isnan(atr) and not atr <= self.atr_max:
+            self.atr_max = atr
+        values['atr'] = atr / self.atr_max * 100 if self.atr_max else math.nan
+
+        self.previous_close = close
+        self.values = values
+
+        return values
+
+    def update(self, bars):
+        '''
+        Adds one bar or a batch of bars and returns the indicators of every new bar as dataframe.
+        Bars that are not newer than the last one already processed are skipped, so the whole (re-)fetched
+        history can be handed over and only the new minutes are calculated
+        '''
+        rows = []
+        times = []
+
+        for time, close, high, low in self._bars(bars):
+            if time is not None:
+                time = pd.Timestamp(time)
+                if self.last_time is not None and time <= self.last_time:
+                    continue
+                self.last_time = time
+
+            rows.append(self._push(close, high, low))
+            times.append(time)
+
+        return pd.DataFrame(rows, index=times)
+
+    def latest(self):
+        '''Indicator values of the last bar'''
+        return dict(self.values)
+
+    # ==================================================================================================
+    #                           SAVING AND LOADING
+    # ==================================================================================================
+
+    def to_dict(self):
+        '''The whole state as json friendly dictionary'''
+        def window_state(window):
+            return list(window.values)
+
+        def ema_state(ema):
+            return {'value': ema.value, 'old_weight': ema.old_weight}
+
+        return {
+            'settings': {
+                'sma_windows': self.sma_windows,
+                'ema_windows': self.ema_windows,
+                'rsi_window': self.rsi_window,
+                'macd_windows': self.macd_windows,
+                'bollinger_window': self.bollinger_window,
+                'atr_window': self.atr_window
+            },
+            'sma': {str(window): window_state(sma) for window, sma in self.sma.items()},
+            'ema': {str(window): ema_state(ema) for window, ema in self.ema.items()},
+            'signal': ema_state(self.signal),
+            'bollinger': window_state(self.bollinger),
+            'gains': window_state(self.gains),
+            'losses': window_state(self.losses),
+            'true_ranges': window_state(self.true_ranges),
+            'atr_max': self.atr_max,
+            'previous_close': self.previous_close,
+            'last_time': None if self.last_time is None else self.last_time.isoformat(),
+            'values': self.values
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        '''Rebuilds the indicators from to_dict()'''
+        streaming = cls(**state['settings'])
+
+        for window in streaming.sma:
+            streaming.sma[window] = _RollingWindow(window, state['sma'][str(window)])
+        for window in streaming.ema:
+            streaming.ema[window] = _EMA(window, **state['ema'][str(window)])
+        streaming.signal = _EMA(streaming.macd_windows[2], **state['signal'])
+
+        streaming.bollinger = _RollingWindow(streaming.bollinger_window, state['bollinger'])
+        streaming.gains = _RollingWindow(streaming.rsi_window, state['gains'])
+        streaming.losses = _RollingWindow(streaming.rsi_window, state['losses'])
+        streaming.true_ranges = _RollingWindow(streaming.atr_window, state['true_ranges'])
+
+        streaming.atr_max = state['atr_max']
+        streaming.previous_close = state['previous_close']
+        streaming.last_time = None if state['last_time'] is None else pd.Timestamp(state['last_time'])
+        streaming.values = state['values']
+
+        return streaming
+
+    def save(self, path):
+        '''Save the state as json, written to a temporary file first so a crash never leaves half a file behind'''
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # every save gets its own temporary file, streamlit sessions are threads of one process and can save the
+        # same ticker at the same time
+        with tempfile.NamedTemporaryFile('w', dir=path.parent, prefix=f'{path.stem}.', suffix='.tmp',
+                                         delete=False) as temporary:
+            temporary.write(json.dumps(self.to_dict()))
+        os.replace(temporary.name, path)
+
+    @classmethod
+    def load(cls, path):
+        '''Load a state saved with save(), None if there is none'''
+        path = Path(path)
+        if not path.exists():
+            return None
+
+        return cls.from_dict(json.loads(path.read_text()))
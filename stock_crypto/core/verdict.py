@@ -4,10 +4,10 @@ Provides shared logic, interfaces, and utilities for generating consistent
 verdict outputs from various indicator-specific evaluators.
 """
 
-from indicators_verdict.ma_verdict import ma_verdict
-from indicators_verdict.rsi_verdict import rsi_verdict
-from indicators_verdict.macd_verdict import macd_verdict
-from indicators_verdict.bollinger_verdict import bollinger_verdict
+import numpy as np
+import pandas as pd
+
+from core.verdict_engine import VerdictEngine
 
 
 class Verdict:
@@ -24,51 +24,39 @@ class Verdict:
     ATR: If high volatility, adjust buyer score
     '''
 
-    def __init__(self, data, sma_long, sma_short, ema_Long, ema_short, rsi, signal_line, macd_line, lower_band, upper_band, atr):
-        '''Initialize the Verdict class with necessary indicators.'''
+    def __init__(self, data, sma_long, sma_short, ema_Long, ema_short, rsi, signal_line, macd_line, lower_band, upper_band, atr, engine=None):
+        '''
+        Initialize the Verdict class with necessary indicators.
+        The scoring is done by the VerdictEngine (the same rules the heatmap uses for all tickers at once)
+        '''
         # Store the latest values of the indicators
         self.price = data['Close'].iloc[-1]
 
         self.sma_short = sma_short
         self.sma_long = sma_long
-        self.buyer_score = 0
-
-        ma_verdict_sma = ma_verdict(
-            self.price, self.sma_short, self.sma_long)
-        self.buyer_score += ma_verdict_sma.buyer_score
-
-        ma_verdict_ema = ma_verdict(
-            self.price, ema_short, ema_Long)
-        self.buyer_score += ma_verdict_ema.buyer_score
 
-        rsi_verdict_instance = rsi_verdict(rsi)
-        self.buyer_score += rsi_verdict_instance.buyer_score
+        def last_two(values):
+            # the rules only look at the latest and the previous value
+            return np.asarray(values, dtype=np.float64)[-2:]
 
-        macd_verdict_instance = macd_verdict(macd_line, signal_line)
-        self.buyer_score += macd_verdict_instance.buyer_score
+        engine = engine if engine is not None else VerdictEngine()
+        self.engine = engine
+        self.buyer_score = float(engine.scores(
+            [self.price], last_two(sma_long), last_two(sma_short), last_two(ema_Long), last_two(ema_short), last_two(rsi),
+            last_two(signal_line), last_two(macd_line), last_two(lower_band), last_two(upper_band), atr))
 
-        bollinger_verdict_instance = bollinger_verdict(
-            self.price, lower_band, upper_band, sma_long)
-        self.buyer_score += bollinger_verdict_instance.buyer_score
-
-        if atr > 70:
-            self.buyer_score *= 0.8
-        elif atr < 30:
-            self.buyer_score *= 1.2
-        else:
-            pass
+        if np.isnan(self.buyer_score):
+            raise ValueError("No RSI available, can't give a verdict")
 
         self.verdict = self.get_verdict()
 
+    @classmethod
+    def from_snapshot(cls, snapshot, engine=None):
+        '''Verdict from an IndicatorSnapshot (Indicators.snapshot()) instead of the full indicator series'''
+        return cls({'Close': pd.Series(snapshot.close)}, snapshot.sma_long, snapshot.sma_short, snapshot.ema_long,
+                   snapshot.ema_short, snapshot.rsi, snapshot.signal_line, snapshot.macd_line, snapshot.lower_band,
+                   snapshot.upper_band, snapshot.atr, engine)
+
     def get_verdict(self):
         '''Generate the final verdict based on the buyer score.'''
-        if self.buyer_score >= 18:
-            return "Strong Buy"
-        elif self.buyer_score <= -18:
-            return "Strong Sell"
-        elif 10 <= self.buyer_score < 18:
-            return "Buy"
-        elif -18 < self.buyer_score <= -10:
-            return "Sell"
-        else:
-            return "Hold"
+        return self.engine.verdicts(self.buyer_score).item()
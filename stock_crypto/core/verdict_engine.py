@@ -0,0 +1,174 @@
+'''
+Scores the whole universe at once: the VerdictEngine takes the indicators of all tickers as arrays and returns the
+buyer scores and verdicts as arrays, with the same point rules as the Verdict class (which is a thin wrapper around it).
+Instead of 500 Verdict objects with 500 if/elif chains, the heatmap does a few array comparisons.
+'''
+
+import numpy as np
+import pandas as pd
+
+from core.batch_indicators import BatchIndicators, restore_alignment, right_align
+from core.indicator_pipeline import IndicatorPipeline
+from indicators_verdict.ma_verdict import ma_scores
+from indicators_verdict.rsi_verdict import rsi_scores
+from indicators_verdict.macd_verdict import macd_scores
+from indicators_verdict.bollinger_verdict import bollinger_scores
+
+
+# everything the verdict looks at, except the ATR (for the history it's scaled differently, see history_arrays)
+VERDICT_INDICATORS = IndicatorPipeline("sma30, sma100, ema12, ema26, macd(12,26,9), bb(30), rsi14")
+
+
+class VerdictRules:
+    '''
+    The thresholds of the verdict, the defaults are the rules the verdict has always used.
+    For example: VerdictRules(rsi_thresholds=(20, 50, 80)) for stricter overbought/oversold levels
+    '''
+
+    def __init__(self, ma_short_thresholds=(2, 4), ma_long_thresholds=(4, 8), rsi_thresholds=(30, 50, 70),
+                 bollinger_thresholds=(0.2, 0.8), atr_thresholds=(30, 70), atr_multipliers=(1.2, 0.8),
+                 buy_score=10, strong_score=18):
+        # percent distance of the price from the long ma (2 and 4) and from the short ma (4 and 8) for 1 and 2 points
+        self.ma_short_thresholds = ma_short_thresholds
+        self.ma_long_thresholds = ma_long_thresholds
+        # oversold, middle and overbought rsi
+        self.rsi_thresholds = rsi_thresholds
+        self.bollinger_thresholds = bollinger_thresholds
+        # below the low atr the score is multiplied by the first multiplier, above the high atr by the second one
+        self.atr_thresholds = atr_thresholds
+        self.atr_multipliers = atr_multipliers
+        # scores from buy_score on are Buy (Sell for negative), from strong_score on Strong Buy (Strong Sell)
+        self.buy_score = buy_score
+        self.strong_score = strong_score
+
+
+class VerdictEngine:
+    '''
+    Buyer scores and verdicts for many tickers at once.
+    For example: engine = VerdictEngine()
+                 scores, verdicts = engine.evaluate(batch.snapshot())
+
+    Every indicator is an array with (previous, latest) in its first axis and one column per ticker (like the fields of
+    an IndicatorSnapshot), atr holds only the latest value. Tickers without an RSI get a NaN score and None as verdict.
+    The windows decide which indicators history calculates, e.g. VerdictEngine(rsi_window=7, sma_windows=(20, 50))
+    '''
+
+    def __init__(self, rules=None, sma_windows=(30, 100), ema_windows=(12, 26), macd_windows=(12, 26, 9),
+                 bollinger_window=30, rsi_window=14, atr_window=14):
+        self.rules = rules if rules is not None else VerdictRules()
+
+        # the windows are only used by history, evaluate scores a snapshot that was calculated with its own windows
+        self.sma_windows = sma_windows
+        self.ema_windows = ema_windows
+        self.macd_windows = macd_windows
+        self.bollinger_window = bollinger_window
+        self.rsi_window = rsi_window
+        self.atr_window = atr_window
+
+        spec = (f"sma{sma_windows[0]}, sma{sma_windows[1]}, ema{ema_windows[0]}, ema{ema_windows[1]}, "
+                f"macd({macd_windows[0]},{macd_windows[1]},{macd_windows[2]}), bb({bollinger_window}), rsi{rsi_window}")
+        self.indicators = VERDICT_INDICATORS if spec == VERDICT_INDICATORS.spec else IndicatorPipeline(spec)
+
+    def scores(self, close, sma_long, sma_short, ema_long, ema_short, rsi, signal_line, macd_line, lower_band,
+               upper_band, atr):
+        '''Buyer scores, same arguments in the same order as Verdict'''
+        rules = self.rules
+        price = np.asarray(close, dtype=np.float64)[-1]
+        atr = np.asarray(atr, dtype=np.float64)
+
+        buyer_score = ma_scores(price, sma_short, sma_long, rules.ma_short_thresholds, rules.ma_long_thresholds)
+        buyer_score = buyer_score + ma_scores(price, ema_short, ema_long, rules.ma_short_thresholds,
+                                              rules.ma_long_thresholds)
+        buyer_score = buyer_score + rsi_scores(np.asarray(rsi, dtype=np.float64)[-1], rules.rsi_thresholds)
+        buyer_score = buyer_score + macd_scores(macd_line, signal_line)
+        buyer_score = buyer_score + bollinger_scores(price, lower_band, upper_band, sma_long,
+                                                     rules.bollinger_thresholds)
+
+        # high volatility makes the score smaller, low volatility bigger
+        low_atr, high_atr = rules.atr_thresholds
+        low_multiplier, high_multiplier = rules.atr_multipliers
+        buyer_score = np.select([atr > high_atr, atr < low_atr],
+                                [buyer_score * high_multiplier, buyer_score * low_multiplier], buyer_score)
+
+        return buyer_score
+
+    def verdicts(self, buyer_score):
+        '''Turns buyer scores into Strong Buy, Buy, Hold, Sell and Strong Sell (None for a NaN score)'''
+        buyer_score = np.asarray(buyer_score, dtype=np.float64)
+        buy, strong = self.rules.buy_score, self.rules.strong_score
+
+        verdicts = np.full(buyer_score.shape, "Hold", dtype=object)
+        verdicts[(-strong < buyer_score) & (buyer_score <= -buy)] = "Sell"
+        verdicts[(buy <= buyer_score) & (buyer_score < strong)] = "Buy"
+        verdicts[buyer_score <= -strong] = "Strong Sell"
+        verdicts[buyer_score >= strong] = "Strong Buy"
+        verdicts[np.isnan(buyer_score)] = None
+
+        return verdicts
+
+    def evaluate(self, snapshot):
+        '''Scores and verdicts of an IndicatorSnapshot'''
+        buyer_score = self.scores(snapshot.close, snapshot.sma_long, snapshot.sma_short, snapshot.ema_long,
+                                  snapshot.ema_short, snapshot.rsi, snapshot.signal_line, snapshot.macd_line,
+                                  snapshot.lower_band, snapshot.upper_band, snapshot.atr)
+
+        return buyer_score, self.verdicts(buyer_score)
+
+    def history_arrays(self, prices):
+        '''
+        Buyer scores and verdicts for every row of 2-D price arrays (field -> dates x tickers, every ticker's prices at
+        the bottom, see right_align). Row t is scored with the indicators of row t and t - 1, which is exactly what
+        Verdict gives for the data up to row t, since all indicators only look back. Only the ATR is scaled by the
+        highest value up to that row instead of over the whole history
+        '''
+        close = prices['Close']
+        indicators = self.indicators.calculate(prices)
+        atr = BatchIndicators(close, prices['High'], prices['Low']).atr_series(self.atr_window, expanding=True)
+
+        def with_previous(values):
+            # (previous, latest) for every row
+            previous = np.vstack([np.full((1,) + values.shape[1:], np.nan), values[:-1]])
+            return np.stack([previous, values])
+
+        sma_short, sma_long = self.sma_windows
+        ema_short, ema_long = self.ema_windows
+        macd = '_'.join(str(window) for window in self.macd_windows)
+        bollinger, rsi = self.bollinger_window, self.rsi_window
+
+        closes = with_previous(close)
+        buyer_score = self.scores(closes, with_previous(indicators[f'sma{sma_long}']),
+                                  with_previous(indicators[f'sma{sma_short}']),
+                                  with_previous(indicators[f'ema{ema_long}']), with_previous(indicators[f'ema{ema_short}']),
+                                  with_previous(indicators[f'rsi{rsi}']), with_previous(indicators[f'signal{macd}']),
+                                  with_previous(indicators[f'macd{macd}']), with_previous(indicators[f'lower_band{bollinger}']),
+                                  with_previous(indicators[f'upper_band{bollinger}']), atr)
+
+        # the verdict needs a previous bar
+        buyer_score = np.where(np.isnan(closes[0]), np.nan, buyer_score)
+
+        return buyer_score, self.verdicts(buyer_score)
+
+    def history(self, data):
+        '''
+        Buyer score and verdict of every bar in one pass, as if the verdict had been run on the data up to that bar.
+        data is one ticker's dataframe (returns a dataframe with buyer_score and verdict columns) or a PricePanel
+        (returns a dataframe with (buyer_score/verdict, ticker) columns on the panel's dates)
+        '''
+        fields = ('Close', 'High', 'Low')
+
+        if isinstance(data, pd.DataFrame):
+            prices = {field: data[field].to_numpy(dtype=np.float64)[:, None] for field in fields}
+            buyer_score, verdicts = self.history_arrays(prices)
+
+            return pd.DataFrame({'buyer_score': buyer_score[:, 0],
+                                 'verdict': pd.Series(verdicts[:, 0], index=data.index, dtype=object)}, index=data.index)
+
+        # a panel: gaps in the shared calendar would otherwise end up in the rolling windows
+        valid = ~np.isnan(data.close)
+        buyer_score, _ = self.history_arrays({field: right_align(data.arrays[field], valid) for field in fields})
+        buyer_score = restore_alignment(buyer_score, valid)
+
+        return pd.concat({
+            'buyer_score': pd.DataFrame(buyer_score, index=data.dates, columns=data.tickers),
+            'verdict': pd.DataFrame(self.verdicts(buyer_score), index=data.dates, columns=data.tickers, dtype=object)
+        }, axis=1)
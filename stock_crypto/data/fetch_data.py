@@ -1,44 +1,49 @@
-import yfinance as yf
+from data.local_store import ohlcv_store
 
 # https://algotrading101.com/learn/yahoo-finance-api-guide/
+# everything goes through the local store in data_saved/ohlcv_store, so only missing bars are downloaded from yfinance
 
 
 class stock_data:
     def __init__(self):
         pass
 
-    def fetch_stock_data(ticker_symbol, period, interval):
+    def fetch_stock_data(ticker_symbol, period, interval, raise_errors=False):
         """
         This fetches the data from today to six months ago. Works best with single stocks.
         YF gives us a df with the ticker, close open high and low-prices as well as an index
+        raise_errors=True hands errors to the caller (e.g. the FetchExecutor, so it can retry) instead of printing them
         """
 
         # search for ticker in yahoo and get all the data connected to that ticker
         try:
 
-            ticker = yf.Ticker(ticker_symbol)
-            data = ticker.history(period=period, interval=interval)
+            data = ohlcv_store.history(ticker_symbol, interval, period=period)
 
             return data[['Close', 'Open', 'High', 'Low']]
 
         except Exception as e:
+            if raise_errors:
+                raise
             # fails if ticker is not existent and give me debugging options
-            print(f"{e}")
+            print(f"Could not fetch {ticker_symbol}: {e}")
             return None
 
-    def fetch_stock_data_set_dates(ticker_symbol, start, end):
+    def fetch_stock_data_set_dates(ticker_symbol, start, end, raise_errors=False):
         '''
         I mainly use it to fezch history with set dates for the historical heatmaps, so I can add Quarter start and end and get all the 
         important info for the quarter
+        raise_errors works the same as in fetch_stock_data
         '''
         try:
-            ticker = yf.Ticker(ticker_symbol)
-            data = ticker.history(start=start, end=end)
+            data = ohlcv_store.history(ticker_symbol, '1d', start=start, end=end)
 
             return data
 
         except Exception as e:
-            print(f"{e}")
+            if raise_errors:
+                raise
+            print(f"Could not fetch {ticker_symbol} from {start} to {end}: {e}")
             return None
 
     def fetch_multiple_stocks_data(ticker_symbols, period, interval):
@@ -47,8 +52,8 @@ class stock_data:
         as we need a lot of tickers at once for the heatmap. 
         """
         # get data for multiple tickers, way way way faster than looping through them one by one
-        tickers = yf.download(ticker_symbols, period=period, interval=interval,
-                              group_by='ticker', threads=True, auto_adjust=True, progress=False)
+        # tickers already on disk only download their newest bars (if any)
+        tickers = ohlcv_store.history_many(ticker_symbols, interval, period=period)
 
         return tickers
 
@@ -57,7 +62,6 @@ class stock_data:
         Fetch historical stock data for multiple ticker symbols within a date range.
         Idea is to use it for the database for quicker work, not implemented yet
         """
-        tickers = yf.download(ticker_symbols, start=start, end=end,
-                              group_by='ticker', threads=True, auto_adjust=True, progress=False)
+        tickers = ohlcv_store.history_many(ticker_symbols, '1d', start=start, end=end)
 
         return tickers
@@ -0,0 +1,208 @@
+'''
+Runs many per-ticker downloads at the same time instead of one after another.
+The FetchExecutor takes a list of tickers and a fetch function, runs them on a thread pool (or asyncio), keeps the
+number of downloads at once and per second in check and retries failed downloads with an exponential backoff.
+Results come back as soon as they are done, tickers that failed end up in executor.errors instead of being printed.
+
+The rate limit only counts real downloads: the data layer calls acquire_rate_limit() right before it goes to the
+network, so tickers that are served from the local store are not slowed down.
+'''
+
+import asyncio
+import contextvars
+import inspect
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+
+class TokenBucket:
+    '''
+    Simple token bucket rate limiter: rate tokens get added per second, up to capacity.
+    Every request takes one token and waits if there is none left
+    '''
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        if capacity is None:
+            capacity = 1.0 if rate is None else max(1.0, rate)
+        self.capacity = capacity
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _take(self):
+        '''Take a token if there is one, otherwise return how long to wait for the next one'''
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        '''Blocks until a token is available'''
+        if self.rate is None:
+            return
+        wait = self._take()
+        while wait > 0:
+            time.sleep(wait)
+            wait = self._take()
+
+    async def acquire_async(self):
+        '''Same as acquire(), but doesn't block the event loop'''
+        if self.rate is None:
+            return
+        wait = self._take()
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = self._take()
+
+
+# rate limiter of the executor the current fetch is running in (None outside of an executor)
+_active_bucket = contextvars.ContextVar('active_bucket', default=None)
+
+
+def acquire_rate_limit():
+    '''Call this right before a network request, waits if the running FetchExecutor is over its rate limit'''
+    bucket = _active_bucket.get()
+    if bucket is not None:
+        bucket.acquire()
+
+
+class FetchExecutor:
+    '''
+    Fetches data for many tickers concurrently.
+    For example: executor = FetchExecutor(max_workers=8, rate=10)
+                 for ticker, data in executor.map(tickers, fetch_function):
+                     ...
+                 executor.errors -> {ticker: error message} for everything that failed
+
+    max_workers: downloads running at the same time
+    rate: network requests started per second (None for no limit), see acquire_rate_limit()
+    retries, backoff: a failed download is tried again after backoff, 2 * backoff, 4 * backoff ... seconds
+    mode: 'thread' for a thread pool, 'asyncio' for an event loop (fetch may then also be a coroutine function)
+    '''
+
+    def __init__(self, max_workers=8, rate=10.0, retries=3, backoff=0.5, mode='thread'):
+        if mode not in ('thread', 'asyncio'):
+            raise ValueError(f"Unknown mode {mode}, use thread or asyncio")
+
+        self.max_workers = max_workers
+        self.bucket = TokenBucket(rate, capacity=max_workers)
+        self.retries = retries
+        self.backoff = backoff
+        self.mode = mode
+        self.errors = {}
+
+    def _check(self, ticker, data):
+        '''Empty answers are not worth retrying (ticker does not exist or has no data in that range)'''
+        if data is None or (isinstance(data, (pd.DataFrame, pd.Series)) and data.empty):
+            raise LookupError(f"No data for {ticker}")
+
+        return data
+
+    def _limited(self, fetch, ticker):
+        '''Runs fetch(ticker) with the rate limiter of this executor active'''
+        token = _active_bucket.set(self.bucket)
+        try:
+            return fetch(ticker)
+        finally:
+            _active_bucket.reset(token)
+
+    def _fetch_with_retries(self, ticker, fetch):
+        '''Runs fetch(ticker) in a worker thread, with rate limiting and retries'''
+        for attempt in range(self.retries + 1):
+            try:
+                return self._check(ticker, self._limited(fetch, ticker))
+            except LookupError:
+                raise
+            except Exception:
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+
+    async def _fetch_with_retries_async(self, ticker, fetch, semaphore):
+        '''Same as _fetch_with_retries, but on the event loop. Normal functions are moved to a thread'''
+        async with semaphore:
+            for attempt in range(self.retries + 1):
+                try:
+                    if inspect.iscoroutinefunction(fetch):
+                        # coroutines can't wait inside acquire_rate_limit() without blocking the loop, so every
+                        # attempt counts as a request here
+                        await self.bucket.acquire_async()
+                        data = await fetch(ticker)
+                    else:
+                        data = await asyncio.to_thread(self._limited, fetch, ticker)
+                    return ticker, self._check(ticker, data)
+                except LookupError as e:
+                    return ticker, e
+                except Exception as e:
+                    if attempt == self.retries:
+                        return ticker, e
+                    await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    async def map_async(self, tickers, fetch):
+        '''Async generator of (ticker, data) in the order the downloads finish'''
+        semaphore = asyncio.Semaphore(self.max_workers)
+        tasks = [self._fetch_with_retries_async(ticker, fetch, semaphore) for ticker in tickers]
+
+        for task in asyncio.as_completed(tasks):
+            ticker, result = await task
+            if isinstance(result, Exception):
+                self.errors[ticker] = str(result)
+            else:
+                yield ticker, result
+
+    def _map_thread(self, tickers, fetch):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {pool.submit(self._fetch_with_retries, ticker, fetch): ticker for ticker in tickers}
+
+            for future in as_completed(futures):
+                ticker = futures[future]
+                try:
+                    data = future.result()
+                except Exception as e:
+                    self.errors[ticker] = str(e)
+                    continue
+
+                yield ticker, data
+
+    def _map_asyncio(self, tickers, fetch):
+        '''Runs the event loop in a helper thread, so the results can be handed out while downloads are still running'''
+        results = queue.Queue()
+        done = object()
+
+        async def collect():
+            async for item in self.map_async(tickers, fetch):
+                results.put(item)
+
+        def run():
+            try:
+                asyncio.run(collect())
+            finally:
+                results.put(done)
+
+        threading.Thread(target=run, daemon=True).start()
+
+        while (item := results.get()) is not done:
+            yield item
+
+    def map(self, tickers, fetch):
+        '''
+        Generator of (ticker, data) in the order the downloads finish, fetch(ticker) has to return the data
+        or raise an exception. Failed tickers are skipped and collected in self.errors
+        '''
+        self.errors = {}
+
+        if self.mode == 'asyncio':
+            return self._map_asyncio(tickers, fetch)
+
+        return self._map_thread(tickers, fetch)
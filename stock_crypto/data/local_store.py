@@ -0,0 +1,320 @@
+'''
+Local on-disk store for OHLCV data, so we don't download the whole history from yfinance every single time.
+Every ticker gets its own parquet file per provider and interval
+(data_saved/ohlcv_store/<provider>/<interval>/<ticker>.parquet) and a small json file next to it that remembers how
+far back the file reaches and when it was last refreshed.
+On a later call only the bars after the last stored timestamp are downloaded and appended.
+'''
+
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from data.fetch_executor import acquire_rate_limit
+from data.providers import DAILY_INTERVALS, INTRADAY_REACH, get_provider, period_start, slice_period, _as_index_time
+
+
+STORE_PATH = Path("stock_crypto/data_saved/ohlcv_store")
+
+# relative difference of a close that means the provider adjusted the history again (split or dividend)
+ADJUSTMENT_TOLERANCE = 1e-4
+
+
+class OHLCVStore:
+    '''
+    Reads OHLCV data from disk first and only goes to the data provider (yfinance) for what is missing.
+    For example: store = OHLCVStore()
+                 store.history('AAPL', '1d', period='6mo')
+
+    refresh_seconds decides how long stored data counts as up to date, calls within that time never touch the network
+    '''
+
+    def __init__(self, path=STORE_PATH, refresh_seconds=60):
+        self.path = Path(path)
+        self.refresh_seconds = refresh_seconds
+
+    # ==================================================================================================
+    #                           FILE HANDLING
+    # ==================================================================================================
+
+    def _partition(self, ticker, interval):
+        '''
+        Path of the parquet file for ticker and interval, the json with the metadata lives next to it.
+        Every provider has its own folder, replayed or synthetic prices never end up in the live data
+        '''
+        return self.path / get_provider().name / interval / f"{ticker}.parquet"
+
+    def read(self, ticker, interval):
+        '''Returns the stored data and its metadata, or (None, None) if nothing is stored yet'''
+        partition = self._partition(ticker, interval)
+        meta_file = partition.with_suffix('.json')
+
+        if not partition.exists() or not meta_file.exists():
+            return None, None
+
+        data = pd.read_parquet(partition)
+        meta = json.loads(meta_file.read_text())
+
+        return data, meta
+
+    def write(self, ticker, interval, data, covered_from):
+        '''
+        Write data and metadata, covered_from is the earliest point in time the data is complete from (None = max).
+        Files are written to a temporary file first and then swapped in, so a crash never leaves half a file behind
+        '''
+        partition = self._partition(ticker, interval)
+        partition.parent.mkdir(parents=True, exist_ok=True)
+
+        meta = {
+            'covered_from': None if covered_from is None else pd.Timestamp(covered_from).isoformat(),
+            'refreshed_at': time.time()
+        }
+
+        # every write gets its own temporary file, streamlit sessions are threads of one process and can write the
+        # same ticker at the same time
+        temporary = self._temporary(partition, '.tmp')
+        data.to_parquet(temporary)
+        os.replace(temporary, partition)
+
+        temporary_meta = self._temporary(partition, '.json.tmp')
+        temporary_meta.write_text(json.dumps(meta))
+        os.replace(temporary_meta, partition.with_suffix('.json'))
+
+    def _temporary(self, partition, suffix):
+        '''New empty temporary file next to the partition'''
+        with tempfile.NamedTemporaryFile(dir=partition.parent, prefix=f'{partition.stem}.', suffix=suffix,
+                                         delete=False) as handle:
+            return Path(handle.name)
+
+    # ==================================================================================================
+    #                           DOWNLOADING AND MERGING
+    # ==================================================================================================
+
+    def _normalise(self, data, interval):
+        '''Clean up freshly downloaded data so it can be merged with what is stored'''
+        data = data.dropna(how='all')
+
+        # daily bars get a timezone-naive index, so yf.download and yf.Ticker.history (one gives naive, the other
+        # tz-aware dates) can be merged into the same file
+        if interval in DAILY_INTERVALS and getattr(data.index, 'tz', None) is not None:
+            data.index = data.index.tz_localize(None)
+
+        return data
+
+    def _merge(self, stored, new, interval):
+        '''Append new bars to the stored ones, the last stored bar gets overwritten because it might have been incomplete'''
+        new = self._normalise(new, interval)
+
+        if stored is None or stored.empty:
+            return new
+        if new.empty:
+            return stored
+
+        stored_tz = getattr(stored.index, 'tz', None)
+        new_tz = getattr(new.index, 'tz', None)
+        if stored_tz is not None and new_tz is not None:
+            new.index = new.index.tz_convert(stored_tz)
+
+        merged = pd.concat([stored, new])
+        merged = merged[~merged.index.duplicated(keep='last')]
+
+        return merged.sort_index()
+
+    def _needs(self, stored, meta, start, end=None, interval='1d'):
+        '''
+        Decide what has to be downloaded for a ticker:
+        'local' -> everything is on disk, 'tail' -> only the newest bars are missing, 'full' -> download everything
+        '''
+        if stored is None or stored.empty:
+            return 'full'
+
+        covered_from = meta.get('covered_from')
+        if covered_from is not None and (start is None or pd.Timestamp(start) < pd.Timestamp(covered_from)):
+            return 'full'
+
+        # if we refreshed after the requested end, there is nothing new to get for that range
+        if end is not None and pd.Timestamp(meta['refreshed_at'], unit='s') >= pd.Timestamp(end):
+            return 'local'
+
+        if time.time() - meta['refreshed_at'] < self.refresh_seconds:
+            return 'local'
+
+        # the newest stored minute bars are older than what the provider still serves, a tail would come back empty
+        reach = INTRADAY_REACH.get(interval)
+        if reach is not None:
+            now = get_provider().clock(stored)
+            now = pd.Timestamp.now() if now is None else now
+            last_bar = stored.index[-1]
+            last_bar = last_bar.tz_convert(None) if last_bar.tzinfo is not None else last_bar
+            if now - last_bar > reach:
+                return 'full'
+
+        return 'tail'
+
+    def _tail_start(self, stored):
+        '''
+        The tail is downloaded from the second to last stored bar on: the last one may have been incomplete, the one
+        before is finished and shows if the provider adjusted the prices since (see _adjusted_since)
+        '''
+        return stored.index[-2] if len(stored) > 1 else stored.index[-1]
+
+    def _adjusted_since(self, stored, new):
+        '''
+        True if the closes of the finished bars that are stored and freshly downloaded don't match anymore.
+        The prices are adjusted for splits and dividends, so after one the whole history changes and the new bars
+        don't fit onto the stored ones (a 4:1 split would look like a -75% day)
+        '''
+        index = new.index
+        stored_tz = getattr(stored.index, 'tz', None)
+        if stored_tz is not None and getattr(index, 'tz', None) is not None:
+            index = index.tz_convert(stored_tz)
+
+        overlap = stored.index[:-1].intersection(index)
+        if overlap.empty:
+            return False
+
+        stored_close = stored.loc[overlap, 'Close'].to_numpy(dtype=np.float64)
+        new_close = new.set_axis(index).loc[overlap, 'Close'].to_numpy(dtype=np.float64)
+
+        return not np.allclose(new_close, stored_close, rtol=ADJUSTMENT_TOLERANCE, atol=0, equal_nan=True)
+
+    def _needed_from(self, stored, period, start):
+        '''
+        First point in time the request needs. Periods count back from the clock of the provider: now for live data,
+        the last stored bar for replays (so a replay gives the same answer on every day)
+        '''
+        if period is None:
+            return start
+
+        return period_start(period, get_provider().clock(stored))
+
+    def _fetch(self, ticker, interval, period=None, start=None):
+        '''Single ticker download, either the whole period or everything from start on'''
+        acquire_rate_limit()
+        return get_provider().history(ticker, interval, period=period, start=start)
+
+    def _fetch_many(self, tickers, interval, period=None, start=None):
+        '''Download many tickers at once, returns a dictionary of dataframes'''
+        acquire_rate_limit()
+        return get_provider().download(tickers, interval, period=period, start=start)
+
+    def _update(self, ticker, interval, stored, meta, action, period=None, start=None, new=None):
+        '''Merge and save the result of a download, returns the full stored data of the ticker'''
+        if action == 'local':
+            return stored
+
+        if action == 'tail':
+            covered_from = meta.get('covered_from')
+            if new is None:
+                new = self._fetch(ticker, interval, start=self._tail_start(stored))
+            new = self._normalise(new, interval)
+
+            # nothing new (or the download failed): keep the file and its refresh time as they are
+            if new.empty:
+                return stored
+
+            if self._adjusted_since(stored, new):
+                # download everything the file covered again, with the new adjustment
+                print(f"{ticker}: prices were adjusted since the last download, downloading the history again")
+                action, new = 'full', None
+                period, start = ('max', None) if covered_from is None else (None, pd.Timestamp(covered_from))
+            else:
+                data = self._merge(stored, new, interval)
+
+        if action == 'full':
+            # a full download replaces what we had, it reaches back further anyway
+            if new is None:
+                new = self._fetch(ticker, interval, period=period, start=start)
+            data = self._merge(None, new, interval)
+            covered_from = start if period is None else period_start(period, get_provider().clock(data))
+
+        # don't save empty downloads, e.g. if the ticker does not exist
+        if data is not None and not data.empty:
+            self.write(ticker, interval, data, covered_from)
+
+        return data
+
+    # ==================================================================================================
+    #                           PUBLIC ACCESS
+    # ==================================================================================================
+
+    def history(self, ticker, interval, period=None, start=None, end=None):
+        '''
+        Same as yf.Ticker(ticker).history(...) but served from disk where possible.
+        Either use period or start (and end)
+        '''
+        stored, meta = self.read(ticker, interval)
+        needed_from = self._needed_from(stored, period, start)
+        action = self._needs(stored, meta, needed_from, end, interval)
+
+        data = self._update(ticker, interval, stored, meta, action, period=period, start=start)
+
+        return self._select(data, period, start, end)
+
+    def history_many(self, tickers, interval, period=None, start=None, end=None):
+        '''
+        Same as yf.download(tickers, group_by='ticker', ...), tickers are sorted into ones we have on disk, ones that
+        only need their newest bars and ones we need completely, the last two are downloaded in one batch each
+        '''
+        stored = {}
+        actions = {'local': [], 'tail': [], 'full': []}
+        for ticker in tickers:
+            stored[ticker] = self.read(ticker, interval)
+            needed_from = self._needed_from(stored[ticker][0], period, start)
+            actions[self._needs(*stored[ticker], needed_from, end, interval)].append(ticker)
+
+        results = {}
+        for ticker in actions['local']:
+            results[ticker] = stored[ticker][0]
+
+        if actions['tail']:
+            tail_start = min(self._tail_start(stored[ticker][0]) for ticker in actions['tail'])
+            downloaded = self._fetch_many(actions['tail'], interval, start=tail_start)
+            for ticker in actions['tail']:
+                # if the download failed for a ticker we still have what is stored
+                if ticker in downloaded:
+                    results[ticker] = self._update(
+                        ticker, interval, *stored[ticker], 'tail', new=downloaded[ticker])
+                else:
+                    results[ticker] = stored[ticker][0]
+
+        if actions['full']:
+            downloaded = self._fetch_many(actions['full'], interval, period=period, start=start)
+            for ticker, new in downloaded.items():
+                results[ticker] = self._update(
+                    ticker, interval, *stored[ticker], 'full', period=period, start=start, new=new)
+
+        frames = {
+            ticker: self._select(results[ticker], period, start, end) for ticker in tickers
+            if ticker in results and results[ticker] is not None and not results[ticker].empty
+        }
+
+        if not frames:
+            return pd.DataFrame()
+
+        # same layout as yf.download with group_by='ticker', so callers don't notice the difference
+        return pd.concat(frames, axis=1)
+
+    def _select(self, data, period, start, end):
+        '''Cut the stored data to the requested period or dates'''
+        if data is None or data.empty:
+            return data
+
+        if period is not None:
+            return slice_period(data, period, now=get_provider().clock(data))
+
+        if start is not None:
+            data = data[data.index >= _as_index_time(start, data.index)]
+        if end is not None:
+            data = data[data.index < _as_index_time(end, data.index)]
+
+        return data
+
+
+# shared store, every stock_data call goes through this one
+ohlcv_store = OHLCVStore()
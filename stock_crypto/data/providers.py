@@ -0,0 +1,390 @@
+'''
+Market data providers. Everything that needs prices or the S&P 500 table asks get_provider() instead of talking to
+yfinance or Wikipedia directly, so the whole app can also run offline.
+
+There are three of them:
+YFinanceProvider  -> the normal one, yfinance for prices and Wikipedia for the S&P 500 table
+RecordingProvider -> wraps another provider and saves every answer to data_saved/recordings
+ReplayProvider    -> answers from those recordings (or synthetic random walks) with a fixed latency, no network needed
+
+Which one is used can be chosen with the STOCK_DATA_PROVIDER environment variable (yfinance, record or replay)
+or with set_provider() in code, e.g. for benchmarks.
+'''
+
+import os
+import re
+import time
+import urllib.request
+import zlib
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+
+RECORDINGS_PATH = Path("stock_crypto/data_saved/recordings")
+SP500_URL = 'https://en.wikipedia.org/wiki/List_of_S%26P_500_companies'
+
+# intervals that produce one bar per day or less
+DAILY_INTERVALS = ('1d', '5d', '1wk', '1mo', '3mo')
+
+# how far back yfinance serves intraday bars in one request, older minute bars can't be downloaded anymore
+INTRADAY_REACH = {'1m': pd.Timedelta(days=7), '2m': pd.Timedelta(days=59), '5m': pd.Timedelta(days=59),
+                  '15m': pd.Timedelta(days=59), '30m': pd.Timedelta(days=59), '90m': pd.Timedelta(days=59),
+                  '60m': pd.Timedelta(days=729), '1h': pd.Timedelta(days=729)}
+
+
+def period_start(period, now=None):
+    '''
+    Translates a yfinance period string (e.g. 6mo, 10y, 7d, ytd, max) into the first timestamp the period needs.
+    Returns None for max, since that reaches back as far as yfinance has data
+    '''
+    now = pd.Timestamp.now() if now is None else now
+    today = now.normalize()
+
+    if period == 'max':
+        return None
+    if period == 'ytd':
+        return pd.Timestamp(today.year, 1, 1)
+
+    match = re.fullmatch(r'(\d+)(d|wk|mo|y)', period)
+    if match is None:
+        raise ValueError(f"Unknown period {period}")
+
+    number, unit = int(match.group(1)), match.group(2)
+
+    if unit == 'd':
+        # yfinance counts trading days, so add some buffer for weekends and holidays
+        return today - pd.Timedelta(days=number + 2 * (number // 5) + 5)
+    if unit == 'wk':
+        return today - pd.Timedelta(weeks=number)
+    if unit == 'mo':
+        return today - pd.DateOffset(months=number)
+
+    return today - pd.DateOffset(years=number)
+
+
+def slice_period(data, period, now=None):
+    '''Cut the stored data down to what the period would have returned from yfinance'''
+    if data.empty or period == 'max':
+        return data
+
+    match = re.fullmatch(r'(\d+)d', period)
+    if match is not None:
+        # day periods are trading days, so keep the last n dates that actually have bars
+        days = data.index.normalize().unique()
+        first_day = days[-min(int(match.group(1)), len(days))]
+        return data[data.index.normalize() >= first_day]
+
+    start = _as_index_time(period_start(period, now), data.index)
+
+    return data[data.index >= start]
+
+
+def _as_index_time(timestamp, index):
+    '''Make a timestamp comparable to the index, tz-aware indices need tz-aware timestamps'''
+    timestamp = pd.Timestamp(timestamp)
+    tz = getattr(index, 'tz', None)
+
+    if tz is not None and timestamp.tzinfo is None:
+        return timestamp.tz_localize(tz)
+    if tz is None and timestamp.tzinfo is not None:
+        return timestamp.tz_localize(None)
+
+    return timestamp
+
+
+class MarketDataProvider(ABC):
+    '''
+    Interface every provider has to follow.
+    history() -> one ticker as dataframe, download() -> dictionary of ticker: dataframe, sp500_table() -> Wikipedia table
+    Either use period or start (and end), the same way yfinance does.
+    name keeps the data of different providers apart in the local store, so made up prices never mix with real ones
+    '''
+
+    name = None
+
+    @abstractmethod
+    def history(self, ticker, interval='1d', period=None, start=None, end=None):
+        pass
+
+    @abstractmethod
+    def download(self, tickers, interval='1d', period=None, start=None, end=None):
+        pass
+
+    @abstractmethod
+    def sp500_table(self):
+        pass
+
+    def clock(self, data):
+        '''
+        Point in time a period (e.g. 6mo) of data counts back from, None means now.
+        Live providers always count from now, replays from their recorded data
+        '''
+        return None
+
+
+class YFinanceProvider(MarketDataProvider):
+    '''Live data from yfinance and the S&P 500 table from Wikipedia'''
+
+    name = 'yfinance'
+
+    def _time_range(self, period, start, end):
+        '''yfinance does not like getting period and start at the same time, so only hand over what is set'''
+        if period is not None:
+            return {'period': period}
+
+        return {key: value for key, value in (('start', start), ('end', end)) if value is not None}
+
+    def history(self, ticker, interval='1d', period=None, start=None, end=None):
+        return yf.Ticker(ticker).history(interval=interval, **self._time_range(period, start, end))
+
+    def download(self, tickers, interval='1d', period=None, start=None, end=None):
+        downloaded = yf.download(list(tickers), interval=interval, group_by='ticker', threads=True,
+                                 auto_adjust=True, progress=False, **self._time_range(period, start, end))
+
+        return {
+            ticker: downloaded[ticker] for ticker in tickers if ticker in downloaded.columns.get_level_values(0)
+        }
+
+    def sp500_table(self):
+        '''Looks at the html of Wikipedia and returns the table containing the S&P 500 symbols'''
+        req = urllib.request.Request(SP500_URL, headers={'User-Agent': 'Mozilla/5.0'})
+        html = urllib.request.urlopen(req).read()
+        tables = pd.read_html(html)
+
+        # more robust way because Wikipedia loves changing their site, checks all tables
+        sp500_table = None
+        for table in tables:
+            if 'Symbol' in table.columns:
+                sp500_table = table
+
+        if sp500_table is None:
+            raise ValueError("Could not find the S&P 500 table on Wikipedia")
+
+        return sp500_table
+
+
+class RecordingProvider(MarketDataProvider):
+    '''
+    Passes every request on to another provider (yfinance by default) and saves the answer, so it can be replayed later.
+    Recordings are saved as <path>/<interval>/<ticker>.parquet and <path>/sp500.parquet.
+    It has its own folder in the local store, otherwise tickers that are fresh in the live store would be served from
+    there and never recorded
+    '''
+
+    name = 'recording'
+
+    def __init__(self, provider=None, path=RECORDINGS_PATH):
+        self.provider = YFinanceProvider() if provider is None else provider
+        self.path = Path(path)
+
+
+    def _record(self, ticker, interval, data):
+        '''Add data to the recording of a ticker, newer answers win if bars overlap'''
+        if data is None:
+            return
+
+        # yf.download pads every ticker to the common dates, those rows are empty
+        data = data.dropna(how='all')
+        if data.empty:
+            return
+
+        file = self.path / interval / f"{ticker}.parquet"
+        file.parent.mkdir(parents=True, exist_ok=True)
+
+        if file.exists():
+            recorded = pd.read_parquet(file)
+            # yf.download and Ticker.history disagree on timezones, so stick with the recorded one
+            if getattr(recorded.index, 'tz', None) != getattr(data.index, 'tz', None):
+                data = data.copy()
+                data.index = _match_timezone(data.index, recorded.index)
+            data = pd.concat([recorded, data])
+            data = data[~data.index.duplicated(keep='last')].sort_index()
+
+        data.to_parquet(file)
+
+    def history(self, ticker, interval='1d', period=None, start=None, end=None):
+        data = self.provider.history(ticker, interval, period=period, start=start, end=end)
+        self._record(ticker, interval, data)
+
+        return data
+
+    def download(self, tickers, interval='1d', period=None, start=None, end=None):
+        downloaded = self.provider.download(tickers, interval, period=period, start=start, end=end)
+        for ticker, data in downloaded.items():
+            self._record(ticker, interval, data)
+
+        return downloaded
+
+    def sp500_table(self):
+        table = self.provider.sp500_table()
+        self.path.mkdir(parents=True, exist_ok=True)
+        table.astype(str).to_parquet(self.path / "sp500.parquet")
+
+        return table
+
+
+class ReplayProvider(MarketDataProvider):
+    '''
+    Serves recorded data from disk without any network access, every call takes exactly `latency` seconds.
+    If a ticker was never recorded and synthetic is True, a random walk is generated for it instead. The random walk is
+    seeded with the ticker name, so the same ticker always gets the same prices - good for repeatable benchmarks.
+    Without a recorded sp500.parquet, the universe consists of synthetic_tickers made up tickers (SYN000, SYN001, ...)
+    '''
+
+    name = 'replay'
+
+    def __init__(self, path=RECORDINGS_PATH, latency=0.0, synthetic=True, synthetic_tickers=500,
+                 synthetic_start='2000-01-01', synthetic_end=None):
+        self.path = Path(path)
+        self.latency = latency
+        self.synthetic = synthetic
+        self.synthetic_tickers = synthetic_tickers
+        self.synthetic_start = pd.Timestamp(synthetic_start)
+        # fix the end date if the results have to be identical between days
+        self.synthetic_end = pd.Timestamp.now().normalize() if synthetic_end is None else pd.Timestamp(synthetic_end)
+
+    def _synthetic_history(self, ticker, interval):
+        '''Random walk OHLCV, seeded with the ticker so it's the same every time'''
+        rng = np.random.default_rng(zlib.crc32(f"{ticker}-{interval}".encode()))
+
+        if interval in DAILY_INTERVALS:
+            index = pd.bdate_range(self.synthetic_start, self.synthetic_end)
+        else:
+            # intraday: regular trading hours for the last 30 business days
+            minutes = int(re.fullmatch(r'(\d+)(m|h)', interval).group(1)) * \
+                (60 if interval.endswith('h') else 1)
+            days = pd.bdate_range(end=self.synthetic_end, periods=30)
+            index = pd.DatetimeIndex([
+                time_stamp for day in days
+                for time_stamp in pd.date_range(day + pd.Timedelta(hours=9, minutes=30),
+                                                day + pd.Timedelta(hours=15, minutes=59), freq=f'{minutes}min')])
+
+        # geometric random walk with a bit of drift, start price somewhere between 20 and 500
+        returns = rng.normal(0.0003, 0.02, len(index))
+        close = rng.uniform(20, 500) * np.exp(np.cumsum(returns))
+        open_ = close * np.exp(rng.normal(0, 0.005, len(index)))
+        high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.01, len(index))))
+        low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.01, len(index))))
+        volume = rng.integers(100_000, 10_000_000, len(index)).astype(float)
+
+        return pd.DataFrame({'Open': open_, 'High': high, 'Low': low, 'Close': close, 'Volume': volume},
+                            index=index)
+
+    def clock(self, data):
+        '''Recorded data doesn't move with the calendar, periods count back from the day after its last bar'''
+        if data is None or data.empty:
+            return None
+
+        last_bar = data.index[-1]
+        last_bar = last_bar.tz_localize(None) if last_bar.tzinfo is not None else last_bar
+
+        return last_bar + pd.Timedelta(days=1)
+
+    def _load(self, ticker, interval):
+        file = self.path / interval / f"{ticker}.parquet"
+
+        if file.exists():
+            return pd.read_parquet(file)
+        if self.synthetic:
+            return self._synthetic_history(ticker, interval)
+
+        return pd.DataFrame(columns=['Open', 'High', 'Low', 'Close', 'Volume'])
+
+    def _select(self, data, period, start, end):
+        '''Same slicing yfinance would do, periods count back from the last recorded bar'''
+        if data.empty:
+            return data
+
+        if period is not None:
+            return slice_period(data, period, now=self.clock(data))
+
+        if start is not None:
+            data = data[data.index >= _as_index_time(start, data.index)]
+        if end is not None:
+            data = data[data.index < _as_index_time(end, data.index)]
+
+        return data
+
+    def history(self, ticker, interval='1d', period=None, start=None, end=None):
+        time.sleep(self.latency)
+
+        return self._select(self._load(ticker, interval), period, start, end)
+
+    def download(self, tickers, interval='1d', period=None, start=None, end=None):
+        time.sleep(self.latency)
+
+        downloaded = {}
+        for ticker in tickers:
+            data = self._select(self._load(ticker, interval), period, start, end)
+            if not data.empty:
+                downloaded[ticker] = data
+
+        return downloaded
+
+    def sp500_table(self):
+        time.sleep(self.latency)
+
+        file = self.path / "sp500.parquet"
+        if file.exists():
+            return pd.read_parquet(file)
+
+        sectors = ['Information Technology', 'Financials', 'Health Care', 'Energy', 'Industrials',
+                   'Consumer Discretionary', 'Consumer Staples', 'Utilities', 'Materials', 'Real Estate',
+                   'Communication Services']
+        symbols = [f"SYN{number:03d}" for number in range(self.synthetic_tickers)]
+
+        return pd.DataFrame({
+            'Symbol': symbols,
+            'Security': [f"Synthetic Company {number}" for number in range(self.synthetic_tickers)],
+            'GICS Sector': [sectors[number % len(sectors)] for number in range(self.synthetic_tickers)]
+        })
+
+
+def _match_timezone(index, reference):
+    '''Bring index into the timezone of reference (tz-aware or naive)'''
+    reference_tz = getattr(reference, 'tz', None)
+
+    if index.tz is None:
+        return index if reference_tz is None else index.tz_localize(reference_tz)
+    if reference_tz is None:
+        return index.tz_localize(None)
+
+    return index.tz_convert(reference_tz)
+
+
+def _provider_from_environment():
+    '''Pick the provider with STOCK_DATA_PROVIDER, yfinance is the default'''
+    choice = os.environ.get('STOCK_DATA_PROVIDER', 'yfinance')
+    path = os.environ.get('STOCK_DATA_RECORDINGS', RECORDINGS_PATH)
+
+    if choice == 'record':
+        return RecordingProvider(path=path)
+    if choice == 'replay':
+        return ReplayProvider(path=path, latency=float(os.environ.get('STOCK_DATA_REPLAY_LATENCY', 0.0)))
+    if choice == 'yfinance':
+        return YFinanceProvider()
+
+    raise ValueError(f"Unknown STOCK_DATA_PROVIDER {choice}, use yfinance, record or replay")
+
+
+_provider = None
+
+
+def get_provider():
+    '''The provider everybody should use'''
+    global _provider
+
+    if _provider is None:
+        _provider = _provider_from_environment()
+
+    return _provider
+
+
+def set_provider(provider):
+    '''Swap the provider, e.g. set_provider(ReplayProvider(latency=0.05)) for an offline benchmark'''
+    global _provider
+    _provider = provider
@@ -0,0 +1,122 @@
+'''
+Keeps the S&P 500 universe (symbol, company name and GICS sector) in one place.
+The Wikipedia table is parsed once, saved to data_saved/universe/<provider>/sp500.parquet and served from memory
+afterwards, so the screener, the conversion runs and the network graph don't download and parse Wikipedia every time.
+After ttl seconds the table is refreshed once, refresh() does it manually.
+'''
+
+import json
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from data.providers import get_provider
+
+
+UNIVERSE_PATH = Path("stock_crypto/data_saved/universe/sp500.parquet")
+
+
+class UniverseRegistry:
+    '''
+    Serves the S&P 500 universe from memory, the local snapshot or (if both are too old) the data provider.
+    For example: sp500_universe.tickers() -> ['MMM', 'AOS', ...]
+                 sp500_universe.company_info() -> {'MMM': {'name': '3M', 'sector': 'Industrials'}, ...}
+
+    Every data provider has its own snapshot (<folder of path>/<provider>/sp500.parquet) and its own table in memory,
+    so the made up universe of a replay never shows up in a live run
+    '''
+
+    def __init__(self, path=UNIVERSE_PATH, ttl=24 * 60 * 60):
+        self.path = Path(path)
+        self.ttl = ttl
+
+        # provider name -> (table, fetched_at)
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def _is_fresh(self, fetched_at):
+        return fetched_at is not None and time.time() - fetched_at < self.ttl
+
+    def _snapshot_path(self, provider):
+        return self.path.parent / provider / self.path.name
+
+    def _load_snapshot(self, provider):
+        '''Read the saved table from disk, returns (None, None) if there is none yet'''
+        path = self._snapshot_path(provider)
+        meta_file = path.with_suffix('.json')
+
+        if not path.exists() or not meta_file.exists():
+            return None, None
+
+        return pd.read_parquet(path), json.loads(meta_file.read_text())['fetched_at']
+
+    def refresh(self):
+        '''Parse the table from the data provider (Wikipedia) again and save it'''
+        provider = get_provider()
+        table = provider.sp500_table()
+
+        # only keep what we need, wikipedia uses dots in some ticker symbols, but yfinance needs dashes (BF.B -> BF-B)
+        table = pd.DataFrame({
+            'Symbol': table['Symbol'].astype(str).str.replace(".", "-", regex=False),
+            'Security': table['Security'].astype(str),
+            'GICS Sector': table['GICS Sector'].astype(str)
+        })
+        fetched_at = time.time()
+
+        path = self._snapshot_path(provider.name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        table.to_parquet(path)
+        path.with_suffix('.json').write_text(json.dumps({'fetched_at': fetched_at}))
+
+        with self._lock:
+            self._tables[provider.name] = (table, fetched_at)
+
+        return table
+
+    def table(self):
+        '''The universe as dataframe with the columns Symbol, Security and GICS Sector'''
+        provider = get_provider().name
+
+        with self._lock:
+            table, fetched_at = self._tables.get(provider, (None, None))
+            if table is not None and self._is_fresh(fetched_at):
+                return table
+
+        snapshot, snapshot_fetched_at = self._load_snapshot(provider)
+        if snapshot is not None and self._is_fresh(snapshot_fetched_at):
+            with self._lock:
+                self._tables[provider] = (snapshot, snapshot_fetched_at)
+            return snapshot
+
+        try:
+            return self.refresh()
+        except Exception as e:
+            # an old universe is better than no universe, e.g. if we are offline
+            if snapshot is None and table is None:
+                raise
+            print(f"Could not refresh the S&P 500 universe, using the saved one: {e}")
+            with self._lock:
+                if table is None:
+                    table = snapshot
+                # try again after another ttl instead of on every call
+                self._tables[provider] = (table, time.time())
+                return table
+
+    def tickers(self):
+        '''All symbols of the universe in yfinance format'''
+        return self.table()['Symbol'].tolist()
+
+    def company_info(self):
+        '''Dictionary mapping every ticker to its company name and sector'''
+        table = self.table()
+
+        return {
+            ticker: {'name': name, 'sector': sector}
+            for ticker, name, sector in zip(table['Symbol'], table['Security'], table['GICS Sector'])
+        }
+
+
+# shared registry, every screener, conversion run and graph uses this one
+sp500_universe = UniverseRegistry()
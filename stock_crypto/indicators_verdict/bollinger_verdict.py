@@ -3,6 +3,28 @@ Generates verdicts based on Bollinger Bands. Evaluates band touches,
 volatility expansion or contraction, and price position within the bands.
 """
 
+import numpy as np
+
+
+def bollinger_scores(price, lower_band, upper_band, sma_long, thresholds=(0.2, 0.8), scale=100):
+    '''
+    Points for the position of the latest price between the bands, for many tickers at once (bands and sma hold
+    (previous, latest) in their first axis). Above the long sma a high position counts as breakout (3 or 1 points),
+    below it a low position counts as breakdown (-3 or -1 points).
+    The position is in percent (scale=100) but the thresholds are fractions, that's how the verdict has always been scored
+    '''
+    low, high = thresholds
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bollinger_percentage = (price - lower_band[-1]) / (upper_band[-1] - lower_band[-1]) * scale
+
+    bullish = price > sma_long[-1]
+    bearish = price < sma_long[-1]
+
+    return np.select([bullish & (bollinger_percentage > high), bullish & (bollinger_percentage > low),
+                      bearish & (bollinger_percentage < low), bearish & (bollinger_percentage < high)],
+                     [3, 1, -3, -1], 0)
+
 
 class bollinger_verdict:
     """
@@ -30,27 +52,10 @@ class bollinger_verdict:
         break out.
         If we are in a bearish market a high bb% is considered a signal for overbought conditions and is treated differently here
         '''
-        buyer_score = 0
-        bollinger_percentage = (self.price - self.lower_band.iloc[-1]) / (
-            self.upper_band.iloc[-1] - self.lower_band.iloc[-1]) * 100
-
-        if self.price > self.sma_long.iloc[-1]:
-            # Price is above long-term SMA -> Bullish context, Higher BB% could indicate breakout
-            # if price is below momentum a high BB% could mean overbought
-            if bollinger_percentage > 0.8:
-                buyer_score += 3
-            elif bollinger_percentage > 0.2:
-                buyer_score += 1
-            else:
-                pass
-
-        elif self.price < self.sma_long.iloc[-1]:
-            # Price is below long-term SMA -> Bearish context, Lower BB% could indicate breakdown
-            # if price is above momentum a low BB% could mean oversold
-            if bollinger_percentage < 0.2:
-                buyer_score -= 3
-            elif bollinger_percentage < 0.8:
-                buyer_score -= 1
-            else:
-                pass
-        return buyer_score
+        # Price above the long-term SMA -> Bullish context, Higher BB% could indicate breakout
+        # Price below the long-term SMA -> Bearish context, Lower BB% could indicate breakdown
+        def last_two(values):
+            return np.asarray(values, dtype=np.float64)[-2:]
+
+        return int(bollinger_scores(self.price, last_two(self.lower_band), last_two(self.upper_band),
+                                    last_two(self.sma_long)))
@@ -3,6 +3,49 @@ Generates verdicts based on moving averages, supporting both EMA and SMA.
 Evaluates trend direction, price relative to averages, and crossover behavior.
 """
 
+import numpy as np
+
+
+def difference_scores(price, ma_short, ma_long, short_thresholds=(2, 4), long_thresholds=(4, 8)):
+    '''
+    Points for the distance between the price and the moving averages, for many tickers at once.
+    ma_short and ma_long hold (previous, latest) in their first axis, price is the latest price
+    '''
+    with np.errstate(divide='ignore', invalid='ignore'):
+        short_diff = ((price - ma_long[-1]) / ma_long[-1]) * 100
+        long_diff = ((price - ma_short[-1]) / ma_short[-1]) * 100
+
+    def points(difference, thresholds):
+        low, high = thresholds
+        # NaN fits none of the conditions and gets 0 points
+        return np.select([difference > high, (low < difference) & (difference <= high),
+                          difference < -high, (-high <= difference) & (difference < -low)], [2, 1, -2, -1], 0)
+
+    return points(short_diff, short_thresholds) + points(long_diff, long_thresholds)
+
+
+def change_scores(ma_short, ma_long):
+    '''One point up or down for each moving average that moved up or down within the last day'''
+    def points(ma):
+        change = ma[-1] - ma[-2]
+        return np.select([change > 0, change < 0], [1, -1], 0)
+
+    return points(ma_short) + points(ma_long)
+
+
+def crossover_scores(ma_short, ma_long):
+    '''5 points for a golden cross and -5 for a death cross within the last day'''
+    golden = (ma_short[-2] < ma_long[-2]) & (ma_short[-1] > ma_long[-1])
+    death = (ma_short[-2] > ma_long[-2]) & (ma_short[-1] < ma_long[-1])
+
+    return np.select([golden, death], [5, -5], 0)
+
+
+def ma_scores(price, ma_short, ma_long, short_thresholds=(2, 4), long_thresholds=(4, 8)):
+    '''All moving average points (difference, change and crossover) for many tickers at once'''
+    return (difference_scores(price, ma_short, ma_long, short_thresholds, long_thresholds)
+            + change_scores(ma_short, ma_long) + crossover_scores(ma_short, ma_long))
+
 
 class ma_verdict:
     """
@@ -11,6 +54,7 @@ class ma_verdict:
     This class examines how price interacts with one or more moving averages,
     evaluates their slope and trend strength, and interprets crossover events
     between EMAs, SMAs, or mixed pairs to assess momentum and trend direction.
+    The point rules themselves are the functions above, so one ticker and the whole universe are scored the same way.
     """
 
     def __init__(self, price, ma_short, ma_long):
@@ -30,81 +74,30 @@ class ma_verdict:
         '''Calculate the percentage difference between two values.'''
         return ((price - ma) / ma) * 100
 
+    def _last_two(self):
+        return np.asarray(self.ma_short, dtype=np.float64)[-2:], np.asarray(self.ma_long, dtype=np.float64)[-2:]
+
     def difference_verdict(self):
         '''
         Generate verdict based on the difference between short and long moving averages.
 
-        If the difference between a ma and the current price is high, we generally think that there is more momentum in 
+        If the difference between a ma and the current price is high, we generally think that there is more momentum in
         movement and therefore a buy signal will be ommited.
+        Thresholds: 2 and 4 percent from the long ma, 4 and 8 percent from the short ma (it's more volatile)
         '''
-
-        buyer_score = 0
-        # Calculate the percentage differences
-        short_diff = self.get_difference(self.price, self.ma_long.iloc[-1])
-
-        long_diff = self.get_difference(self.price, self.ma_short.iloc[-1])
-
-        # Determine verdict based on the differences
-        if short_diff > 4:
-            buyer_score += 2
-        elif 2 < short_diff <= 4:
-            buyer_score += 1
-        elif short_diff < -4:
-            buyer_score -= 2
-        elif -4 <= short_diff < -2:
-            buyer_score -= 1
-        else:
-            buyer_score += 0
-
-        # use 8 as threshold for long difference because long ma is less volatile
-        if long_diff > 8:
-            buyer_score += 2
-        elif 4 < long_diff <= 8:
-            buyer_score += 1
-        elif long_diff < -8:
-            buyer_score -= 2
-        elif -8 <= long_diff < -4:
-            buyer_score -= 1
-        else:
-            buyer_score += 0
-
-        return buyer_score
+        return int(difference_scores(self.price, *self._last_two()))
 
     def change_verdict(self):
         '''
         Generate verdict based on the change in moving averages.
         If moving averages change within the last day in either of the directions we give a small nudge signal basically
         '''
-        buyer_score = 0
-        # Calculate the changes in moving averages
-        short_change = self.ma_short.iloc[-1] - self.ma_short.iloc[-2]
-        long_change = self.ma_long.iloc[-1] - self.ma_long.iloc[-2]
-
-        # Determine verdict based on the changes
-        if short_change > 0:
-            buyer_score += 1
-        elif short_change < 0:
-            buyer_score -= 1
-
-        if long_change > 0:
-            buyer_score += 1
-        elif long_change < 0:
-            buyer_score -= 1
-
-        return buyer_score
+        return int(change_scores(*self._last_two()))
 
     def crossover_verdict(self):
         '''
         Generate verdict based on moving average crossover.
-        If golden/deatb cross is seen, we take that into consideration by giving a huge signal, as it 
+        If golden/deatb cross is seen, we take that into consideration by giving a huge signal, as it
         is the clearest indicator for buy we have
         '''
-        buyer_score = 0
-        # Check for crossover -> very strong buy/sell signal
-
-        if self.ma_short.iloc[-2] < self.ma_long.iloc[-2] and self.ma_short.iloc[-1] > self.ma_long.iloc[-1]:
-            buyer_score += 5
-        elif self.ma_short.iloc[-2] > self.ma_long.iloc[-2] and self.ma_short.iloc[-1] < self.ma_long.iloc[-1]:
-            buyer_score -= 5
-
-        return buyer_score
+        return int(crossover_scores(*self._last_two()))
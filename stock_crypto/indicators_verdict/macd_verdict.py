@@ -3,6 +3,36 @@ Generates a verdict based on MACD behavior. Evaluates line positions,
 momentum shifts, and crossover events to produce a signal.
 """
 
+import numpy as np
+
+
+def position_scores(macd_line, signal_line):
+    '''2 points if the macd line is above the signal line, -2 if it's below (first axis holds (previous, latest))'''
+    return np.select([macd_line[-1] > signal_line[-1], macd_line[-1] < signal_line[-1]], [2, -2], 0)
+
+
+def movement_scores(macd_line, signal_line):
+    '''One point up or down for each line that moved up or down within the last day'''
+    def points(line):
+        movement = line[-1] - line[-2]
+        return np.select([movement > 0, movement < 0], [1, -1], 0)
+
+    return points(macd_line) + points(signal_line)
+
+
+def crossover_scores(macd_line, signal_line):
+    '''5 points if the macd line crossed the signal line upwards within the last day, -5 for downwards'''
+    upwards = (macd_line[-2] < signal_line[-2]) & (macd_line[-1] > signal_line[-1])
+    downwards = (macd_line[-2] > signal_line[-2]) & (macd_line[-1] < signal_line[-1])
+
+    return np.select([upwards, downwards], [5, -5], 0)
+
+
+def macd_scores(macd_line, signal_line):
+    '''All MACD points (position, movement and crossover) for many tickers at once'''
+    return (position_scores(macd_line, signal_line) + movement_scores(macd_line, signal_line)
+            + crossover_scores(macd_line, signal_line))
+
 
 class macd_verdict:
     """
@@ -24,58 +54,28 @@ class macd_verdict:
         self.buyer_score += self.movement_verdict()
         self.buyer_score += self.crossover_verdict()
 
+    def _last_two(self):
+        return np.asarray(self.macd_line, dtype=np.float64)[-2:], np.asarray(self.signal_line, dtype=np.float64)[-2:]
+
     def calculate_verdict(self):
         '''
         Generate verdict based on MACD line and signal line
 
-        Here we are looking at the relative position between macd line and signal line, giving off 2 points at most, 
+        Here we are looking at the relative position between macd line and signal line, giving off 2 points at most,
         if macd line is above signal line
         '''
-        buyer_score = 0
-
-        # Determine verdict based on MACD line and signal line
-        if self.macd_line.iloc[-1] > self.signal_line.iloc[-1]:
-            buyer_score += 2
-        elif self.macd_line.iloc[-1] < self.signal_line.iloc[-1]:
-            buyer_score -= 2
-        else:
-            buyer_score += 0
-
-        return buyer_score
+        return int(position_scores(*self._last_two()))
 
     def movement_verdict(self):
         '''
         Generate verdict based on the movement of MACD and signal lines.
         Here we kinda look at momentum, that means, if the lines move upwards, a buy signal of one is given
         '''
-        buyer_score = 0
-        # Calculate the movements
-        macd_movement = self.macd_line.iloc[-1] - self.macd_line.iloc[-2]
-        signal_movement = self.signal_line.iloc[-1] - self.signal_line.iloc[-2]
-
-        # Determine verdict based on the movements
-        if macd_movement > 0:
-            buyer_score += 1
-        elif macd_movement < 0:
-            buyer_score -= 1
-
-        if signal_movement > 0:
-            buyer_score += 1
-        elif signal_movement < 0:
-            buyer_score -= 1
-
-        return buyer_score
+        return int(movement_scores(*self._last_two()))
 
     def crossover_verdict(self):
         '''
         Generate verdict based on MACD crossover events.
         If lines cross, we behave similarly than with ma crossings and give 5 signals
         '''
-        buyer_score = 0
-        # Check for recent crossover events
-        if self.macd_line.iloc[-2] < self.signal_line.iloc[-2] and self.macd_line.iloc[-1] > self.signal_line.iloc[-1]:
-            buyer_score += 5
-        elif self.macd_line.iloc[-2] > self.signal_line.iloc[-2] and self.macd_line.iloc[-1] < self.signal_line.iloc[-1]:
-            buyer_score -= 5
-
-        return buyer_score
+        return int(crossover_scores(*self._last_two()))
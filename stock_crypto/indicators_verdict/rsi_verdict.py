@@ -3,6 +3,19 @@ Generates a verdict based on Relative Strength Index (RSI) values.
 Provides utilities for interpreting RSI signals and producing a final decision.
 """
 
+import numpy as np
+
+
+def rsi_scores(rsi_value, thresholds=(30, 50, 70)):
+    '''
+    Points for the latest RSI of many tickers at once: 3 below oversold, 1 up to the middle, -1 above it and -3 above
+    overbought. A missing RSI gets NaN, there is no verdict without it
+    '''
+    oversold, middle, overbought = thresholds
+
+    return np.select([rsi_value > overbought, (middle < rsi_value) & (rsi_value <= overbought),
+                      (oversold <= rsi_value) & (rsi_value <= middle), rsi_value < oversold], [-3, -1, 1, 3], np.nan)
+
 
 class rsi_verdict:
     """
@@ -22,11 +35,7 @@ class rsi_verdict:
         Traders differentiate between overbought rsi>70 and oversold rsi<30, so therse signals
         give of stronger signals 
         '''
-        if self.rsi_value > 70:
-            return -3
-        elif 50 < self.rsi_value <= 70:
-            return -1
-        elif 30 <= self.rsi_value <= 50:
-            return 1
-        elif self.rsi_value < 30:
-            return 3
+        score = rsi_scores(self.rsi_value)
+
+        # no rsi, no score (None like before)
+        return None if np.isnan(score) else int(score)